@@ -1,14 +1,157 @@
+import copy
 import pandas as pd
 import numpy as np
 from sklearn.decomposition import PCA
 from denoise_covariance import DenoiseCovariance
+from covariance_estimators import SampleCovariance, DenoisedCovariance, rolling_frame, detach
+from return_panel import as_frame
+
+
+def absorption_ratio_from_covariances(covs, n_components):
+    # PCA is fitted on the covariance matrix itself, so the spectrum is that of the
+    # column-centred covariance C'C; eigvalsh returns it in ascending order.
+    centered = covs - covs.mean(axis=-2, keepdims=True)
+    eig_vals = np.linalg.eigvalsh(np.matmul(np.swapaxes(centered, -1, -2), centered))
+    return eig_vals[..., eig_vals.shape[-1] - n_components:].sum(axis=-1) / eig_vals.sum(axis=-1)
+
+
+def rolling_absorption_ratio(returns, window_size, n_components=None, chunk_size=256, denoise=False, bwidth=.01,
+                             estimator=None, resume=False):
+    # Batched absorption ratio: one stacked eigvalsh call per block of windows from a covariance estimator
+    # (sample covariances by default; with denoise, MP-denoised ones, warm-starting every fit from the last one).
+    returns = pd.DataFrame(as_frame(returns))
+    if n_components is None:
+        n_components = int(round(0.2 * returns.shape[1]))
+    if estimator is None:
+        estimator = SampleCovariance(chunk_size=chunk_size)
+        if denoise:
+            estimator = DenoisedCovariance(estimator, bwidth=bwidth)
+    blocks = ((end, absorption_ratio_from_covariances(covs, n_components))
+              for end, _, covs in estimator.rolling(returns, window_size, resume=resume))
+    return rolling_frame(blocks, returns, 'Absorption_Ratio')
+
+
+class TruncatedEigensolver:
+    # Top-k share of the spectrum of C'C (C the column-centred window covariance) without an N x N eigensolve,
+    # working on the w x N centred window X: with S = X'X / (w - 1) and H the centring matrix, C'C = S H S.
+    # If w <= N its nonzero spectrum is that of the w x w matrix R X H X' R' (X' = QR), solved exactly.
+    # Otherwise subspace iteration with Rayleigh-Ritz applies S H S to an N x p block until the top-k Ritz sum
+    # changes by at most tol (relative), warm-started from the previous window's Ritz vectors, and the
+    # denominator is the trace ||H S||_F^2 = ||S||_F^2 - ||1'S||^2 / N.
+
+    def __init__(self, n_components, oversample=10, tol=1e-8, max_iter=100, seed=0):
+        self.n_components = n_components
+        self.oversample = oversample
+        self.tol = tol
+        self.max_iter = max_iter
+        self.random_state = np.random.default_rng(seed)
+        self.basis = None
+        self.iterations = 0
+
+    def absorption_ratio(self, window):
+        x = np.asarray(window, dtype=np.float64)
+        n_obs, n_assets = x.shape
+        x = (x - x.mean(axis=0)) / np.sqrt(n_obs - 1)
+        if self.n_components >= min(n_obs, n_assets) - 1:
+            # C'C has rank below k, so the top k eigenvalues are the whole spectrum
+            return 1.
+        if n_obs <= n_assets:
+            return self.reduced_absorption_ratio(x)
+        return self.subspace_absorption_ratio(x)
+
+    def reduced_absorption_ratio(self, x):
+        r = np.linalg.qr(x.T, mode='r')
+        row_sums = r.dot(x.sum(axis=1))
+        eig_vals = np.linalg.eigvalsh(r.dot(x.dot(x.T)).dot(r.T) - np.outer(row_sums, row_sums) / x.shape[1])
+        self.iterations = 0
+        return eig_vals[len(eig_vals) - self.n_components:].sum() / eig_vals.sum()
+
+    def subspace_absorption_ratio(self, x):
+        return self.covariance_absorption_ratio(x.T.dot(x))
+
+    def covariance_absorption_ratio(self, cov):
+        # the same top-k share for a window covariance S given directly (e.g. kept current by rank-1 updates)
+        n_assets = len(cov)
+        if self.n_components >= n_assets - 1:
+            return 1.
+        ones_cov = cov.sum(axis=0)
+        total = (cov ** 2).sum() - ones_cov.dot(ones_cov) / n_assets
+
+        def apply(v):
+            image = cov.dot(v)
+            return cov.dot(image - image.mean(axis=0))
+
+        size = min(self.n_components + self.oversample, n_assets - 1)
+        basis = self.basis
+        if basis is None or basis.shape != (n_assets, size):
+            basis = np.linalg.qr(self.random_state.standard_normal((n_assets, size)))[0]
+        previous = np.nan
+        for self.iterations in range(1, self.max_iter + 1):
+            image = apply(basis)
+            ritz_values, ritz_vectors = np.linalg.eigh(basis.T.dot(image))
+            top = ritz_values[size - self.n_components:].sum()
+            basis = np.linalg.qr(image.dot(ritz_vectors[:, ::-1]))[0]
+            if abs(top - previous) <= self.tol * top:
+                break
+            previous = top
+        self.basis = basis
+        return top / total
+
+
+def truncated_absorption_ratio(returns, window_size, n_components=None, solver=None, tol=1e-8):
+    # Absorption ratio from the top-k spectrum of each T x N window (see TruncatedEigensolver);
+    # pass a solver to continue from its basis
+    returns = pd.DataFrame(as_frame(returns))
+    if n_components is None:
+        n_components = int(round(0.2 * returns.shape[1]))
+    solver = solver or TruncatedEigensolver(n_components, tol=tol)
+    values = returns.values
+    absorption_ratio = [solver.absorption_ratio(values[end - window_size + 1:end + 1])
+                        for end in range(window_size - 1, len(values))]
+    return pd.Series(absorption_ratio, index=returns.index[(window_size - 1):], name='Absorption_Ratio',
+                     dtype=np.float64)
+
+
+def rolling_absorption_ratio_pca(returns, window_size, n_components=None):
+    # Reference implementation: one sklearn PCA fit per window
+    returns = pd.DataFrame(returns)
+    if n_components is None:
+        n_components = int(round(0.2 * returns.shape[1]))
+    index = returns.index[(window_size - 1):]
+    absorption_ratio = np.empty(len(index))
+    for end in range(len(index)):
+        sigma = np.cov(returns.iloc[end:window_size + end, :], rowvar=False)
+        absorption_ratio[end] = sum(PCA(n_components=n_components).fit(sigma).explained_variance_ratio_)
+    return pd.Series(absorption_ratio, index=index, name='Absorption_Ratio', dtype=np.float64)
+
+
+def standardize_absorption_ratio(absorption_ratio_raw, short_window=21, long_window=252):
+    short_mean = absorption_ratio_raw.rolling(short_window).mean()
+    long_mean = absorption_ratio_raw.rolling(long_window).mean()
+    std = absorption_ratio_raw.rolling(long_window).std()
+    return ((short_mean - long_mean) / std).dropna()
+
 
 class AbsorptionRatio:
 
-    def __init__(self, returns, window_size):
-        self.returns = returns
+    def __init__(self, returns, window_size, short_window=21, long_window=252, denoise=False, bwidth=.01,
+                 estimator=None, method='dense', tol=1e-8):
+        # a DataFrame or a ReturnPanel (viewed as a frame without copying)
+        self.returns = as_frame(returns)
         self.window_size = window_size
+        self.short_window = short_window
+        self.long_window = long_window
+        self.denoise = denoise
+        self.bwidth = bwidth
+        # any covariance_estimators estimator (PrefixCovariances can be shared with Turbulence); denoise and
+        # bwidth only select the default one
+        self.estimator = estimator
+        # 'dense': batched eigvalsh of every covariance; 'truncated': top-k spectrum only, from the return windows
+        self.method = method
+        self.tol = tol
+        self.solver = None
         self.absorption_ratio_raw = self.calculate_absorption_ratio()
+        self.estimator = detach(self.estimator)
         self.absorption_ratio_standardized = self.standardize()
 
     def estimate_cov(self, ret, bwidth=.01):
@@ -17,27 +160,77 @@ class AbsorptionRatio:
         return DenoiseCovariance(cov=cov, q=q, bwidth=bwidth).deNoiseCov()
 
 
-    def standardize(self,short_window=21, long_window=252):
-        short_mean = self.absorption_ratio_raw.rolling(short_window).mean()
-        long_mean = self.absorption_ratio_raw.rolling(long_window).mean()
-        std = self.absorption_ratio_raw.rolling(long_window).std()
-        return ((short_mean - long_mean) / std).dropna()
+    def standardize(self):
+        return standardize_absorption_ratio(self.absorption_ratio_raw, self.short_window, self.long_window)
 
 
     # calculate_systemic_risk() → systemic risk series
     def calculate_absorption_ratio(self):
+        if self.method == 'truncated':
+            if self.estimator is not None or self.denoise:
+                raise ValueError("method='truncated' works on the sample covariance of the return windows")
+            self.estimator = SampleCovariance()
+            self.solver = TruncatedEigensolver(int(round(0.2 * self.returns.shape[1])), tol=self.tol)
+            return truncated_absorption_ratio(self.returns, self.window_size, solver=self.solver).to_frame()
+        if self.method != 'dense':
+            raise ValueError("method must be 'dense' or 'truncated', got %r" % self.method)
+        if self.estimator is None:
+            self.estimator = SampleCovariance()
+            if self.denoise:
+                self.estimator = DenoisedCovariance(self.estimator, bwidth=self.bwidth)
+        return rolling_absorption_ratio(self.returns, self.window_size, estimator=self.estimator).to_frame()
 
+    def update(self, new_returns):
+        # Append absorption ratios for the rows of new_returns after the last date seen and return them.
+        # New windows need the last window_size - 1 returns and the z-score the last long_window - 1 raw
+        # values, so the indicator work does not grow with history.
+        new_returns = as_frame(new_returns)
+        new_returns = new_returns.loc[new_returns.index > self.returns.index[-1]]
         n_components = int(round(0.2 * self.returns.shape[1]))
-        absorption_ratio_raw = pd.DataFrame(index=self.returns.index[(self.window_size - 1):], columns=['Absorption_Ratio'])
-        start = 0
-        for end in range(len(absorption_ratio_raw)):
-            subsample_returns = self.returns.iloc[start:self.window_size + end, :]
-            sigma = np.cov(subsample_returns, rowvar=False)
-            # sigma = self.estimate_cov(subsample_returns)
-            absorption_ratio = sum(PCA(n_components=n_components).fit(sigma).explained_variance_ratio_)
-            absorption_ratio_raw.iloc[end, 0] = absorption_ratio
-            start += 1
-        return absorption_ratio_raw
+        if self.method == 'truncated':
+            tail = pd.concat([self.returns.iloc[-(self.window_size - 1):], new_returns])
+            new_raw = truncated_absorption_ratio(tail, self.window_size, solver=self.solver).to_frame()
+        elif self.estimator.recursive:
+            new_raw = rolling_absorption_ratio(new_returns, self.window_size, n_components=n_components,
+                                               estimator=self.estimator, resume=True).to_frame()
+        else:
+            tail = pd.concat([self.returns.iloc[-(self.window_size - 1):], new_returns])
+            new_raw = rolling_absorption_ratio(tail, self.window_size, n_components=n_components,
+                                               estimator=self.estimator).to_frame()
+        self.returns = pd.concat([self.returns, new_returns])
+        self.absorption_ratio_raw = pd.concat([self.absorption_ratio_raw, new_raw])
+        raw_tail = self.absorption_ratio_raw.iloc[-(self.long_window + len(new_raw) - 1):]
+        new_standardized = standardize_absorption_ratio(raw_tail, self.short_window, self.long_window)
+        new_standardized = new_standardized.loc[new_standardized.index.isin(new_raw.index)]
+        self.absorption_ratio_standardized = pd.concat([self.absorption_ratio_standardized, new_standardized])
+        return new_raw
+
+    def get_state(self):
+        # everything update() needs, as plain picklable objects
+        return {'window_size': self.window_size,
+                'short_window': self.short_window,
+                'long_window': self.long_window,
+                'denoise': self.denoise,
+                'bwidth': self.bwidth,
+                'estimator': detach(self.estimator),
+                'method': self.method,
+                'tol': self.tol,
+                'solver': copy.deepcopy(self.solver),
+                'returns': self.returns.iloc[-(self.window_size - 1):],
+                'absorption_ratio_raw': self.absorption_ratio_raw.iloc[-(self.long_window - 1):]}
+
+    @classmethod
+    def from_state(cls, state):
+        # Restore from get_state(); absorption_ratio_standardized then only holds values added by update()
+        absorption_ratio = cls.__new__(cls)
+        for name in ['window_size', 'short_window', 'long_window', 'denoise', 'bwidth', 'returns',
+                     'absorption_ratio_raw']:
+            setattr(absorption_ratio, name, state[name])
+        absorption_ratio.estimator = detach(state['estimator'])
+        absorption_ratio.method, absorption_ratio.tol = state['method'], state['tol']
+        absorption_ratio.solver = copy.deepcopy(state['solver'])
+        absorption_ratio.absorption_ratio_standardized = state['absorption_ratio_raw'].iloc[:0]
+        return absorption_ratio
 
 
 if __name__ == '__main__':
@@ -46,4 +239,4 @@ if __name__ == '__main__':
     returns = get_yahoo_data(['SPY', 'TLT', 'LQD', 'HYG', 'GLD', 'VNQ'], start_date=START_DATE,
                              end_date=END_DATE).pct_change()
     returns.dropna(inplace=True)
-    absorption_ratio_raw = AbsorptionRatio(returns, window_size=WINDOW_SIZE)
\ No newline at end of file
+    absorption_ratio_raw = AbsorptionRatio(returns, window_size=WINDOW_SIZE)
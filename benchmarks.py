@@ -0,0 +1,423 @@
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from absorptionratio import (AbsorptionRatio, rolling_absorption_ratio, rolling_absorption_ratio_pca,
+                             truncated_absorption_ratio)
+from covariance_estimators import rolling_covariances, EWMACovariance, LedoitWolfCovariance
+from turbulence import Turbulence
+from denoise_covariance import DenoiseCovariance
+from kkt_attribution import KKT_Attribution
+from streaming_quantile import QUANTILE_ESTIMATORS
+from parameter_sweep import sweep
+from pipeline import risk_indicators
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_HISTORY = os.path.join(BENCHMARK_DIR, 'benchmark_history.jsonl')
+BENCHMARK_GOLDEN = os.path.join(BENCHMARK_DIR, 'benchmark_golden.json')
+
+
+def synthetic_returns(n_obs, n_assets, seed=0):
+    # One-factor daily return panel on a business-day index
+    rng = np.random.default_rng(seed)
+    factor = rng.normal(0., 0.01, size=(n_obs, 1))
+    betas = rng.uniform(0.5, 1.5, size=(1, n_assets))
+    noise = rng.normal(0., 0.01, size=(n_obs, n_assets))
+    index = pd.bdate_range('2000-01-03', periods=n_obs)
+    return pd.DataFrame(factor * betas + noise, index=index, columns=['A%d' % i for i in range(n_assets)])
+
+
+def synthetic_macro_panel(n_obs, seed=0):
+    # Monthly KKT-style panel: a two-state recession regime shifting the means of four macro variables
+    rng = np.random.default_rng(seed)
+    recession = np.zeros(n_obs)
+    state = 0.
+    for t in range(n_obs):
+        state = float(rng.random() < (0.85 if state else 0.02))
+        recession[t] = state
+    shift = recession[:, None] * np.array([-0.04, -0.02, -1., -0.15])
+    values = rng.normal([0.02, 0.015, 1.5, 0.06], [0.02, 0.01, 1., 0.15], size=(n_obs, 4)) + shift
+    index = pd.date_range('1950-01-01', periods=n_obs, freq='MS')
+    panel = pd.DataFrame(values, index=index, columns=['INDPRO', 'PAYEMS', 'T10YFF', 'S&P'])
+    panel['USRECD'] = recession
+    return panel
+
+
+def time_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def benchmark_absorption_ratio(asset_counts=(10, 100, 500), n_windows=250, window_size=252, seed=0):
+    rows = []
+    for n_assets in asset_counts:
+        returns = synthetic_returns(window_size + n_windows - 1, n_assets, seed=seed)
+        loop_time, loop_result = time_call(rolling_absorption_ratio_pca, returns, window_size)
+        batch_time, batch_result = time_call(rolling_absorption_ratio, returns, window_size)
+        rows.append({'n_assets': n_assets,
+                     'n_windows': n_windows,
+                     'loop_seconds': loop_time,
+                     'batched_seconds': batch_time,
+                     'speedup': loop_time / batch_time,
+                     'max_abs_diff': float(np.max(np.abs(loop_result - batch_result)))})
+    return pd.DataFrame(rows).set_index('n_assets')
+
+
+def benchmark_truncated_absorption_ratio(asset_counts=(500, 1000, 2000, 3000), n_windows=5, window_size=252,
+                                         n_components=None, seed=0):
+    # Top-k solver against the dense batched eigvalsh at large N (k = 0.2 N unless given)
+    rows = []
+    for n_assets in asset_counts:
+        returns = synthetic_returns(window_size + n_windows - 1, n_assets, seed=seed)
+        dense_time, dense_result = time_call(rolling_absorption_ratio, returns, window_size, n_components)
+        truncated_time, truncated_result = time_call(truncated_absorption_ratio, returns, window_size, n_components)
+        rows.append({'n_assets': n_assets,
+                     'n_windows': n_windows,
+                     'dense_seconds': dense_time,
+                     'truncated_seconds': truncated_time,
+                     'speedup': dense_time / truncated_time,
+                     'max_abs_diff': float(np.max(np.abs(dense_result - truncated_result)))})
+    return pd.DataFrame(rows).set_index('n_assets')
+
+
+def benchmark_sweep(n_obs=5000, n_assets=20, windows=(63, 126, 189, 252, 378, 504, 630, 756, 882, 1000),
+                    quantiles=(0.8, 0.85, 0.9, 0.95, 0.99), max_workers=None, seed=0):
+    # A windows x quantiles calibration sweep against one run per setting (one streamed pass of covariances for
+    # both indicators, as the pipeline), in one process and over a process pool
+    returns = synthetic_returns(n_obs, n_assets, seed=seed)
+
+    def run_setting(window_size, quantile):
+        return risk_indicators(returns, window_size, denoise=False, quantile=quantile)
+
+    one_time, _ = time_call(run_setting, windows[len(windows) // 2], quantiles[0])
+    separate_time, _ = time_call(lambda: [run_setting(w, q) for w, q in itertools.product(windows, quantiles)])
+    inline_time, inline = time_call(sweep, returns, windows, quantiles, max_workers=0)
+    pool_time, pool = time_call(sweep, returns, windows, quantiles, max_workers=max_workers or os.cpu_count())
+    return pd.Series({'settings': len(windows) * len(quantiles),
+                      'one_setting_seconds': one_time,
+                      'separate_seconds': separate_time,
+                      'sweep_seconds': inline_time,
+                      'sweep_processes_seconds': pool_time,
+                      'speedup': separate_time / pool_time,
+                      'identical': bool(np.allclose(inline, pool, equal_nan=True))})
+
+
+def benchmark_figures(n_obs=6000, max_points=2000, seed=0):
+    # Dashboard trace payload and serialization time: full go.Scatter against decimated go.Scattergl,
+    # on a random-walk (absorption-ratio-like) and a sparse spiky (filtered-turbulence-like) series
+    import plotly.graph_objs as go
+    from visuals import PlotMaker
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range('2000-01-03', periods=n_obs)
+    series = {'lttb': pd.Series(np.cumsum(rng.normal(size=n_obs)) / 20, index=index),
+              'minmax': pd.Series(np.where(rng.random(n_obs) < .05, rng.chisquare(10, n_obs), 0.), index=index)}
+    rows = []
+    for decimation, values in series.items():
+        full_time, full = time_call(lambda: PlotMaker(values, go.Scatter, '', '', '').plot.to_json())
+        decimated_time, decimated = time_call(lambda: PlotMaker(values, go.Scattergl, '', '', '', max_points=max_points,
+                                                                decimation=decimation).plot.to_json())
+        kept = PlotMaker(values, go.Scattergl, '', '', '', max_points=max_points, decimation=decimation).plot.data[0].y
+        spikes = values.nlargest(50)
+        rows.append({'decimation': decimation,
+                     'points': len(kept),
+                     'full_bytes': len(full),
+                     'decimated_bytes': len(decimated),
+                     'full_seconds': full_time,
+                     'decimated_seconds': decimated_time,
+                     'top50_spikes_kept': int(np.isin(spikes.values, kept).sum())})
+    return pd.DataFrame(rows).set_index('decimation')
+
+
+class StubPriceProvider:
+    # Stand-in for openbb: fixed latency per request, deterministic prices, optional transient failures
+
+    def __init__(self, latency=0.05, n_obs=6000, fail_every=0, seed=0):
+        self.latency = latency
+        self.index = pd.bdate_range('2000-01-03', periods=n_obs)
+        self.fail_every = fail_every
+        self.seed = seed
+        self.calls = 0
+
+    def load(self, ticker, start_date=None, end_date=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.fail_every and self.calls % self.fail_every == 0:
+            raise ConnectionError('stub failure for %s' % ticker)
+        rng = np.random.default_rng([self.seed, sum(map(ord, ticker))])
+        prices = 100. * np.exp(np.cumsum(rng.normal(0., 0.01, size=len(self.index))))
+        return pd.Series(prices, index=self.index, name=ticker).loc[start_date:end_date]
+
+
+class BurstBarSource:
+    # Stand-in bar source delivering a price frame in bursts of burst_size bars, as a feed catching up after a
+    # stall, faster than the consumer keeps up
+
+    def __init__(self, prices, burst_size=256):
+        self.prices = prices
+        self.burst_size = burst_size
+        self.tickers = list(prices.columns)
+
+    async def __aiter__(self):
+        for i, (timestamp, prices) in enumerate(zip(self.prices.index, self.prices.values)):
+            yield timestamp, prices
+            if (i + 1) % self.burst_size == 0:
+                await asyncio.sleep(0)
+
+
+def benchmark_streaming(n_bars=5000, n_assets=11, window_size=390, queue_size=64, seed=0):
+    # Streaming service fed bursts of minute bars: 'block' holds the source back, 'conflate' sheds bars
+    from streaming_service import StreamingService
+    returns = synthetic_returns(n_bars, n_assets, seed=seed)
+    prices = 100. * (1. + returns).cumprod()
+    rows = []
+    for overflow in ('block', 'conflate'):
+        service = StreamingService(BurstBarSource(prices), window_size=window_size, queue_size=queue_size,
+                                   overflow=overflow)
+        seconds, _ = time_call(asyncio.run, service.run())
+        stats = service.stats()
+        rows.append(dict(overflow=overflow, seconds=seconds, bars_per_second=n_bars / seconds,
+                         updates=len(service.latencies), **{key: stats[key] for key in
+                                                            ['dropped', 'p50_latency_seconds', 'p99_latency_seconds',
+                                                             'max_latency_seconds']}))
+    return pd.DataFrame(rows).set_index('overflow')
+
+
+def benchmark_fetch(n_tickers=60, latency=0.05, max_workers=8):
+    from data_fetchers import fetch_concurrently
+    tickers = ['T%03d' % i for i in range(n_tickers)]
+    provider = StubPriceProvider(latency=latency)
+    serial_time, serial = time_call(lambda: pd.concat([provider.load(t) for t in tickers], axis=1))
+    provider = StubPriceProvider(latency=latency, fail_every=7)
+    concurrent_time, concurrent = time_call(lambda: pd.concat(
+        fetch_concurrently(provider.load, tickers, max_workers=max_workers, backoff=0.), axis=1))
+    return pd.Series({'n_tickers': n_tickers,
+                      'max_workers': max_workers,
+                      'serial_seconds': serial_time,
+                      'concurrent_seconds': concurrent_time,
+                      'speedup': serial_time / concurrent_time,
+                      'identical': serial.equals(concurrent)})
+
+
+def benchmark_expanding_quantile(sizes=(1000, 10000, 100000), quantile=0.9, seed=0):
+    # Streaming estimators against pandas' expanding quantile on chi-square (turbulence-like) values
+    rows = []
+    rng = np.random.default_rng(seed)
+    for size in sizes:
+        values = pd.Series(rng.chisquare(10, size=size))
+        baseline_time, baseline = time_call(lambda: values.expanding(min_periods=1).quantile(quantile).values)
+        for name, estimator in QUANTILE_ESTIMATORS.items():
+            def run():
+                state = estimator(quantile)
+                return np.array([state.add(value) for value in values])
+            seconds, estimates = time_call(run)
+            error = np.abs(estimates - baseline)[100:] / baseline[100:]
+            rows.append({'size': size,
+                         'estimator': name,
+                         'pandas_seconds': baseline_time,
+                         'seconds': seconds,
+                         'us_per_observation': 1e6 * seconds / size,
+                         'max_rel_error': float(error.max()),
+                         'mean_rel_error': float(error.mean())})
+    return pd.DataFrame(rows).set_index(['size', 'estimator'])
+
+
+def run_absorption_ratio(returns, window_size):
+    return AbsorptionRatio(returns, window_size).absorption_ratio_raw['Absorption_Ratio']
+
+
+def run_absorption_ratio_denoised(returns, window_size):
+    return AbsorptionRatio(returns, window_size, denoise=True).absorption_ratio_raw['Absorption_Ratio']
+
+
+def run_turbulence(returns, window_size):
+    return Turbulence(returns, window_size, quantile=0.9).filtered_turbulence['Turbulence']
+
+
+def run_turbulence_streaming(returns, window_size):
+    return Turbulence(returns, window_size, quantile=0.9, method='streaming').filtered_turbulence['Turbulence']
+
+
+def run_absorption_ratio_truncated(returns, window_size):
+    return AbsorptionRatio(returns, window_size, method='truncated').absorption_ratio_raw['Absorption_Ratio']
+
+
+def run_absorption_ratio_ledoit_wolf(returns, window_size):
+    absorption_ratio = AbsorptionRatio(returns, window_size, estimator=LedoitWolfCovariance())
+    return absorption_ratio.absorption_ratio_raw['Absorption_Ratio']
+
+
+def run_turbulence_ewma(returns, window_size):
+    return Turbulence(returns, window_size, quantile=0.9, estimator=EWMACovariance()).filtered_turbulence['Turbulence']
+
+
+def run_denoise_covariance(returns, window_size, n_windows=50):
+    # MP-denoise the covariances of the last n_windows windows as one warm-started stack
+    covs = np.concatenate([covs for _, _, covs in rolling_covariances(returns.values[-(window_size + n_windows - 1):],
+                                                                      window_size)])
+    denoised = DenoiseCovariance(covs, q=window_size / returns.shape[1], bwidth=.01).deNoiseCov()
+    return pd.Series(np.trace(denoised, axis1=1, axis2=2), index=returns.index[-len(covs):])
+
+
+def run_kkt(macro, window_size=None):
+    kkt = KKT_Attribution(macro.copy(), econ_vars=['INDPRO', 'PAYEMS', 'T10YFF', 'S&P'], recession_var='USRECD')
+    return kkt.df['Probability1.0']
+
+
+# indicator -> (runner, panel kind, largest n_assets worth running)
+INDICATORS = {
+    'absorption_ratio': (run_absorption_ratio, 'returns', 1000),
+    'absorption_ratio_denoised': (run_absorption_ratio_denoised, 'returns', 200),
+    'turbulence': (run_turbulence, 'returns', 50),
+    'turbulence_streaming': (run_turbulence_streaming, 'returns', 1000),
+    'absorption_ratio_truncated': (run_absorption_ratio_truncated, 'returns', 1000),
+    'absorption_ratio_ledoit_wolf': (run_absorption_ratio_ledoit_wolf, 'returns', 1000),
+    'turbulence_ewma': (run_turbulence_ewma, 'returns', 1000),
+    'denoise_covariance': (run_denoise_covariance, 'returns', 1000),
+    'kkt': (run_kkt, 'macro', None),
+}
+
+SUITE_GRIDS = {
+    'quick': {'n_obs': [1000, 2000], 'n_assets': [5, 20], 'window_size': [63, 252]},
+    'full': {'n_obs': [1000, 5000, 20000, 50000], 'n_assets': [5, 50, 200, 1000], 'window_size': [63, 252, 1000]},
+}
+
+GOLDEN_CASE = {'n_obs': 600, 'n_assets': 8, 'window_size': 252, 'seed': 0}
+
+
+def suite_cases(grid, indicators=None):
+    # (indicator, n_obs, n_assets, window_size); windows need more rows than assets and fewer than the panel
+    for name in indicators or INDICATORS:
+        _, panel, max_assets = INDICATORS[name]
+        if panel == 'macro':
+            for n_obs in grid['n_obs']:
+                yield name, n_obs, 4, None
+            continue
+        for n_obs, n_assets, window_size in itertools.product(grid['n_obs'], grid['n_assets'], grid['window_size']):
+            if n_assets <= max_assets and n_assets < window_size < n_obs:
+                yield name, n_obs, n_assets, window_size
+
+
+def make_panel(kind, n_obs, n_assets, seed=0):
+    return synthetic_macro_panel(n_obs, seed) if kind == 'macro' else synthetic_returns(n_obs, n_assets, seed)
+
+
+def run_case(name, n_obs, n_assets, window_size, seed=0, measure_memory=True):
+    # Wall time of one run, then peak traced memory of a second (tracemalloc slows the Python-level loops)
+    runner, kind, _ = INDICATORS[name]
+    panel = make_panel(kind, n_obs, n_assets, seed)
+    seconds, result = time_call(runner, panel, window_size)
+    peak = None
+    if measure_memory:
+        tracemalloc.start()
+        runner(panel, window_size)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'indicator': name, 'n_obs': n_obs, 'n_assets': n_assets, 'window_size': window_size, 'seed': seed,
+            'seconds': seconds, 'peak_bytes': peak, 'summary': summarize(result)}
+
+
+def summarize(series, n_points=10):
+    # compact fingerprint of an indicator series for history records and golden checks
+    values = np.asarray(series, dtype=np.float64)
+    positions = np.linspace(0, len(values) - 1, n_points).astype(int) if len(values) else []
+    return {'length': int(len(values)),
+            'mean': float(np.mean(values)) if len(values) else None,
+            'samples': [float(values[i]) for i in positions]}
+
+
+def environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR, capture_output=True,
+                                  text=True).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'revision': revision,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine()}
+
+
+def run_suite(grid='quick', indicators=None, history=BENCHMARK_HISTORY, measure_memory=True):
+    # Run every case of the grid and append one JSON record per case to the history file
+    env = environment()
+    records = []
+    for case in suite_cases(SUITE_GRIDS[grid], indicators):
+        record = dict(env, grid=grid, **run_case(*case, measure_memory=measure_memory))
+        records.append(record)
+        if history:
+            with open(history, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+    return pd.DataFrame(records).set_index(['indicator', 'n_obs', 'n_assets', 'window_size'])[['seconds',
+                                                                                               'peak_bytes']]
+
+
+def golden_outputs(indicators=None):
+    case = GOLDEN_CASE
+    return {name: summarize(INDICATORS[name][0](make_panel(INDICATORS[name][1], case['n_obs'], case['n_assets'],
+                                                           case['seed']), case['window_size']))
+            for name in indicators or INDICATORS}
+
+
+def update_golden(path=BENCHMARK_GOLDEN):
+    with open(path, 'w') as f:
+        json.dump({'case': GOLDEN_CASE, 'outputs': golden_outputs()}, f, indent=1, sort_keys=True)
+
+
+def check_golden(path=BENCHMARK_GOLDEN, rtol=1e-7, atol=1e-10):
+    # Compare current outputs on the golden case with the recorded ones; returns a list of mismatch messages
+    with open(path) as f:
+        golden = json.load(f)
+    mismatches = []
+    for name, expected in golden['outputs'].items():
+        actual = golden_outputs([name])[name]
+        if actual['length'] != expected['length']:
+            mismatches.append('%s: length %d != %d' % (name, actual['length'], expected['length']))
+        elif not np.allclose(actual['samples'] + [actual['mean']], expected['samples'] + [expected['mean']],
+                             rtol=rtol, atol=atol):
+            mismatches.append('%s: samples %s != %s' % (name, actual['samples'], expected['samples']))
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks and golden-output checks on synthetic data')
+    parser.add_argument('command', nargs='?', default='suite',
+                        choices=['suite', 'check-golden', 'update-golden', 'absorption-ratio', 'truncated', 'fetch',
+                                 'quantile', 'figures', 'sweep', 'streaming'])
+    parser.add_argument('--grid', default='quick', choices=sorted(SUITE_GRIDS))
+    parser.add_argument('--indicator', action='append', choices=sorted(INDICATORS))
+    parser.add_argument('--history', default=BENCHMARK_HISTORY)
+    parser.add_argument('--no-memory', action='store_true')
+    args = parser.parse_args()
+    if args.command == 'suite':
+        print(run_suite(args.grid, args.indicator, history=args.history, measure_memory=not args.no_memory))
+    elif args.command == 'check-golden':
+        mismatches = check_golden()
+        print('\n'.join(mismatches) or 'golden outputs match')
+        raise SystemExit(1 if mismatches else 0)
+    elif args.command == 'update-golden':
+        update_golden()
+    elif args.command == 'absorption-ratio':
+        print(benchmark_absorption_ratio())
+    elif args.command == 'truncated':
+        print(benchmark_truncated_absorption_ratio())
+    elif args.command == 'figures':
+        print(benchmark_figures().to_string())
+    elif args.command == 'sweep':
+        print(benchmark_sweep())
+    elif args.command == 'streaming':
+        print(benchmark_streaming().to_string())
+    elif args.command == 'fetch':
+        print(benchmark_fetch())
+    else:
+        print(benchmark_expanding_quantile())
@@ -1,9 +1,15 @@
 import datetime
+import os
 
 YAHOO_DATA_SOURCE = 'YahooFinance'
+FETCH_MAX_WORKERS = 8
+FETCH_RETRIES = 3
+FETCH_TIMEOUT = 30.
+FETCH_BACKOFF = 1.
 
 ASSET_CLASSES = ['VTI', 'VEA', 'VWO', 'JNK', 'IEF', 'TIP', 'LQD', 'VNQ', 'GCC']
 SECTORS = ['XLC', 'XLY', 'XLP', 'XLE', 'XLF', 'XLV', 'XLI', 'XLB', 'XLRE','XLK', 'XLU']
+UNIVERSES = {'sector': SECTORS, 'asset': ASSET_CLASSES}
 
 INDUSTRIAL_PRODCUTION = 'INDPRO'
 NONFARM_PAYROLLS = 'PAYEMS'
@@ -16,9 +22,50 @@ ECON_VARIABLES = [INDUSTRIAL_PRODCUTION, NONFARM_PAYROLLS,TEN_YEAR_TREASURY_YIEL
 SHILLER_URL ='http://www.econ.yale.edu/~shiller/data/ie_data.xls'
 SHILLER_SHEET_NAME = 'Data'
 SHILLER_SKIP_ROW = 5
+SHILLER_COLUMNS = ['S&P']
 
 WINDOW_SIZE=252
 TURBULENCE_QUANTILE=0.90
+DENOISE_ABSORPTION_RATIO = True
+# calibration grid of parameter_sweep.sweep
+SWEEP_WINDOWS = [63, 126, 252, 504, 1000]
+SWEEP_QUANTILES = [0.90, 0.95, 0.99]
 
 START_DATE = datetime.date(2000,1,1)
-END_DATE = datetime.date(2023,11,30)
\ No newline at end of file
+END_DATE = datetime.date(2023,11,30)
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.riskmonitor', 'cache')
+CACHE_MAX_BYTES = 512 * 2 ** 20
+CACHE_MAX_AGE = datetime.timedelta(hours=12)
+FRED_DATA_SOURCE = 'FRED'
+SHILLER_DATA_SOURCE = 'Shiller'
+
+RESULTS_DIR = os.path.join(os.path.expanduser('~'), '.riskmonitor', 'results')
+# stored results kept per indicator and universe (older input hashes are deleted after each refresh)
+RESULTS_KEEP = 5
+REFRESH_TIME = datetime.time(16, 30)
+REFRESH_TIMEZONE = 'America/New_York'
+DASHBOARD_POLL_INTERVAL = 60 * 1000
+PIPELINE_MAX_WORKERS = os.cpu_count()
+# 'float32' halves the memory of return panels for large universes; indicators still compute in float64 and
+# agree with float64 panels to 1e-6 (relative for turbulence, absolute for the z-scored absorption ratio)
+RETURNS_DTYPE = 'float64'
+
+METRICS_DIR = os.path.join(os.path.expanduser('~'), '.riskmonitor', 'metrics')
+REFRESH_LOG = os.path.join(METRICS_DIR, 'refresh_log.jsonl')
+PROFILE_DIR = os.path.join(METRICS_DIR, 'profiles')
+# profile every refresh (GET /profile on the dashboard runs a single profiled one);
+# pyinstrument is used when installed, else cProfile
+PROFILE_REFRESH = False
+# points per dashboard trace, about two per pixel of a full-width chart; zooming in re-fetches the visible range
+PLOT_MAX_POINTS = 2000
+
+# intraday stream (streaming_service): a wide CSV of minute bars replayed into the dashboard, None to disable
+STREAM_CSV = None
+STREAM_BAR_INTERVAL = 0.
+STREAM_WINDOW_SIZE = 390
+# bars waiting for the indicators; when full, 'block' holds the source back and 'conflate' drops the oldest
+STREAM_QUEUE_SIZE = 256
+STREAM_OVERFLOW = 'conflate'
+STREAM_HISTORY = PLOT_MAX_POINTS
+STREAM_POLL_INTERVAL = 1000
@@ -0,0 +1,220 @@
+import copy
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from denoise_covariance import DenoiseCovariance
+
+# Rolling covariance estimators shared by Turbulence and AbsorptionRatio.
+# estimator.rolling(returns, window_size) yields blocks (end, means, covs): covs[i] and means[i] belong to the
+# window whose last row is row end + i of `returns`. Recursive estimators can also resume from their saved state,
+# in which case every row of `returns` is new and ends a window.
+
+
+def rolling_covariances(values, window_size, chunk_size=256, max_bytes=64 * 2 ** 20):
+    # Yield (first_window, means, covs) for consecutive blocks of rolling sample covariances.
+    # Sums of x and x.x' are carried forward with the rows entering and leaving each window;
+    # every block is re-anchored on a direct product so rounding error does not accumulate.
+    # Only the rows of the current block are converted to float64, so float32 panels are not copied whole.
+    values = np.asarray(values)
+    n_obs, n_assets = values.shape
+    n_windows = n_obs - window_size + 1
+    chunk_size = max(1, min(chunk_size, max_bytes // (8 * n_assets * n_assets)))
+    shift = values.mean(axis=0, dtype=np.float64)
+    for first in range(0, n_windows, chunk_size):
+        last = min(first + chunk_size, n_windows)
+        centered = values[first:last + window_size - 1].astype(np.float64) - shift
+        anchor = centered[:window_size]
+        cross = np.empty((last - first, n_assets, n_assets))
+        sums = np.empty((last - first, n_assets))
+        cross[0], sums[0] = anchor.T.dot(anchor), anchor.sum(axis=0)
+        if last - first > 1:
+            entering = centered[window_size:]
+            leaving = centered[:last - first - 1]
+            cross[1:] = np.einsum('ti,tj->tij', entering, entering) - np.einsum('ti,tj->tij', leaving, leaving)
+            sums[1:] = entering - leaving
+            np.cumsum(cross, axis=0, out=cross)
+            np.cumsum(sums, axis=0, out=sums)
+        means = sums / window_size
+        cross -= window_size * np.einsum('ti,tj->tij', means, means)
+        yield first, means + shift, cross / (window_size - 1)
+
+
+class SampleCovariance:
+    # np.cov of each window, built in blocks from running sums (see rolling_covariances)
+    recursive = False
+
+    def __init__(self, chunk_size=256):
+        self.chunk_size = chunk_size
+
+    def rolling(self, returns, window_size, resume=False):
+        for first, means, covs in rolling_covariances(returns, window_size, chunk_size=self.chunk_size):
+            yield first + window_size - 1, means, covs
+
+
+class EWMACovariance:
+    # Exponentially weighted mean and covariance, seeded with the sample estimate of the first window and
+    # then updated recursively in O(N^2) per row with no window eviction. lam is the decay (RiskMetrics 0.94).
+    recursive = True
+
+    def __init__(self, lam=0.94, chunk_size=256):
+        self.lam = lam
+        self.chunk_size = chunk_size
+        self.mean = None
+        self.cov = None
+
+    def rolling(self, returns, window_size, resume=False):
+        values = np.asarray(returns)
+        seeded = not (resume and self.mean is not None)
+        if seeded:
+            if len(values) < window_size:
+                return
+            seed = values[:window_size].astype(np.float64)
+            self.mean, self.cov = seed.mean(axis=0), np.cov(seed, rowvar=False)
+        alpha = 1. - self.lam
+        for end in range(window_size - 1 if seeded else 0, len(values), self.chunk_size):
+            rows = values[end:end + self.chunk_size].astype(np.float64)
+            means, covs = np.empty(rows.shape), np.empty(rows.shape + rows.shape[1:])
+            for i, row in enumerate(rows):
+                if seeded:
+                    # the seed window already ends on this row
+                    seeded = False
+                else:
+                    delta = row - self.mean
+                    self.mean = self.mean + alpha * delta
+                    self.cov = self.lam * (self.cov + alpha * np.outer(delta, delta))
+                means[i], covs[i] = self.mean, self.cov
+            yield end, means, covs
+
+
+class LedoitWolfCovariance:
+    # Ledoit-Wolf shrinkage of each window's (biased) sample covariance towards a scaled identity, as
+    # sklearn.covariance.ledoit_wolf, computed for a block of windows at a time from strided window views
+    recursive = False
+
+    def __init__(self, chunk_size=256, max_bytes=64 * 2 ** 20):
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+
+    def rolling(self, returns, window_size, resume=False):
+        values = np.asarray(returns)
+        n_assets = values.shape[1]
+        if len(values) < window_size:
+            return
+        windows = sliding_window_view(values, window_size, axis=0)
+        chunk_size = max(1, min(self.chunk_size, self.max_bytes // (8 * n_assets * max(n_assets, window_size))))
+        for first in range(0, len(windows), chunk_size):
+            x = np.swapaxes(windows[first:first + chunk_size], 1, 2)
+            means = x.mean(axis=1, dtype=np.float64)
+            x = x - means[:, None, :]
+            emp_cov = np.matmul(np.swapaxes(x, 1, 2), x) / window_size
+            trace = np.trace(emp_cov, axis1=1, axis2=2)
+            mu = trace / n_assets
+            delta_ = (emp_cov ** 2).sum(axis=(1, 2))
+            beta_ = ((x ** 2).sum(axis=2) ** 2).sum(axis=1)
+            beta = (beta_ / window_size - delta_) / (n_assets * window_size)
+            delta = (delta_ - 2. * mu * trace + n_assets * mu ** 2) / n_assets
+            beta = np.minimum(beta, delta)
+            shrinkage = np.divide(beta, delta, out=np.zeros_like(beta), where=beta != 0)
+            covs = (1. - shrinkage)[:, None, None] * emp_cov
+            covs[:, np.arange(n_assets), np.arange(n_assets)] += (shrinkage * mu)[:, None]
+            yield first + window_size - 1, means, covs
+
+
+class DenoisedCovariance:
+    # Marchenko-Pastur denoised covariances of a base estimator, warm-starting each window's fit from the last
+    recursive = False
+
+    def __init__(self, base=None, bwidth=.01, var0=.5):
+        self.base = base or SampleCovariance()
+        self.bwidth = bwidth
+        self.var0 = var0
+        self.recursive = self.base.recursive
+
+    def rolling(self, returns, window_size, resume=False):
+        yield from self.denoise(self.base.rolling(returns, window_size, resume=resume),
+                                window_size / np.shape(returns)[1])
+
+    def denoise(self, blocks, q):
+        # denoised (end, means, covs) blocks of any estimator's blocks, q being window_size / n_assets
+        denoiser = DenoiseCovariance(cov=None, q=q, bwidth=self.bwidth, var0=self.var0)
+        for end, means, covs in blocks:
+            denoiser.cov = covs
+            covs = denoiser.deNoiseCovs()
+            # keep the last fitted variance, so later calls (update(), a restored state) continue the warm start
+            self.var0 = denoiser.var0
+            yield end, means, covs
+
+
+class PrefixCovariances:
+    # Sample means and covariances for any window length from prefix sums of x and x.x' over the whole panel,
+    # built in one pass, so a sweep over window sizes shares them. Calls on other returns (or resumed ones) are
+    # delegated to a SampleCovariance.
+    # The prefix sums take (T + 1) x N x N float64, about 480 MB for N = 100 over 6,000 days, so this is meant for
+    # universes of up to a few hundred assets; pass zeroed `sums` / `cross` arrays (e.g. in shared memory) to
+    # build them in place.
+
+    def __init__(self, returns, chunk_size=256, sums=None, cross=None):
+        self.estimator = SampleCovariance(chunk_size=chunk_size)
+        self.recursive = False
+        self.chunk_size = chunk_size
+        self.index = returns.index
+        values = np.asarray(returns)
+        n_obs, n_assets = values.shape
+        self.shift = values.mean(axis=0, dtype=np.float64)
+        self.sums = np.zeros((n_obs + 1, n_assets)) if sums is None else sums
+        self.cross = np.zeros((n_obs + 1, n_assets, n_assets)) if cross is None else cross
+        for first in range(0, n_obs, chunk_size):
+            centered = values[first:first + chunk_size].astype(np.float64) - self.shift
+            self.sums[first + 1:first + 1 + len(centered)] = centered
+            self.cross[first + 1:first + 1 + len(centered)] = np.einsum('ti,tj->tij', centered, centered)
+        np.cumsum(self.sums, axis=0, out=self.sums)
+        np.cumsum(self.cross, axis=0, out=self.cross)
+
+    @classmethod
+    def from_arrays(cls, index, shift, sums, cross, chunk_size=256):
+        # prefix sums built elsewhere (e.g. attached from shared memory), used without copying
+        covariances = cls.__new__(cls)
+        covariances.estimator = SampleCovariance(chunk_size=chunk_size)
+        covariances.recursive = False
+        covariances.chunk_size = chunk_size
+        covariances.index, covariances.shift, covariances.sums, covariances.cross = index, shift, sums, cross
+        return covariances
+
+    def rolling(self, returns, window_size, resume=False):
+        if resume or not self.index.equals(getattr(returns, 'index', None)):
+            yield from self.estimator.rolling(returns, window_size, resume=resume)
+            return
+        for end in range(window_size - 1, len(self.index), self.chunk_size):
+            last = min(end + self.chunk_size, len(self.index))
+            entered, left = slice(end + 1, last + 1), slice(end + 1 - window_size, last + 1 - window_size)
+            means = (self.sums[entered] - self.sums[left]) / window_size
+            cross = self.cross[entered] - self.cross[left]
+            cross -= window_size * np.einsum('ti,tj->tij', means, means)
+            yield end, means + self.shift, cross / (window_size - 1)
+
+
+COVARIANCE_ESTIMATORS = {'sample': SampleCovariance, 'ewma': EWMACovariance, 'ledoit_wolf': LedoitWolfCovariance,
+                         'denoised': DenoisedCovariance}
+
+
+def detach(estimator):
+    # The estimator a consumer continues with after its history: the one behind shared PrefixCovariances, and
+    # a private copy, since recursive estimators carry the state of the last window they produced. A wrapped
+    # base (DenoisedCovariance) is detached the same way, so shared prefix sums are never copied.
+    estimator = getattr(estimator, 'estimator', estimator)
+    if getattr(estimator, 'base', None) is not None:
+        detached = copy.copy(estimator)
+        detached.base = detach(estimator.base)
+        return detached
+    return copy.deepcopy(estimator)
+
+
+def rolling_frame(blocks, returns, name):
+    # Series of per-window values from (end, values) blocks, indexed by each window's last date
+    ends, values = [], []
+    for end, block in blocks:
+        ends.append(np.arange(end, end + len(block)))
+        values.append(block)
+    positions = np.concatenate(ends) if ends else np.array([], dtype=int)
+    values = np.concatenate(values) if values else np.array([], dtype=np.float64)
+    return pd.Series(values, index=returns.index[positions], name=name, dtype=np.float64)
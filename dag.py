@@ -0,0 +1,223 @@
+import multiprocessing
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from constants import PIPELINE_MAX_WORKERS, FETCH_MAX_WORKERS
+from return_panel import ReturnPanel
+from instrumentation import METRICS
+
+
+def process_context():
+    # Worker processes are started from a clean server process, never forked from this one: the dashboard
+    # runs request, refresh and streaming threads, and a fork taken while one of them holds a lock (such as
+    # METRICS.lock) would leave the child waiting on it forever
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class Node:
+    # One pipeline step: func(*results of deps, **kwargs). `kind` is 'fetch', 'transform' or 'indicator'
+    # and decides whether the executor runs it on the thread pool or the process pool.
+
+    def __init__(self, name, func, deps=(), kind='indicator', kwargs=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.kind = kind
+        self.kwargs = kwargs or {}
+
+
+class SharedArray:
+    # Picklable handle to a numpy array held in a multiprocessing shared-memory block
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.shape, self.dtype = array.shape, array.dtype
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.name = self.shm.name
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)[...] = array
+
+    @classmethod
+    def zeros(cls, shape, dtype=np.float64):
+        # a zero-filled block to be written in place through attach()
+        shared = cls.__new__(cls)
+        shared.shape, shared.dtype = tuple(shape), np.dtype(dtype)
+        shared.shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * shared.dtype.itemsize, 1))
+        shared.name = shared.shm.name
+        shared.attach()[...] = 0
+        return shared
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = None
+
+    def read(self, unlink=False):
+        shm = self.shm or shared_memory.SharedMemory(name=self.name)
+        array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf).copy()
+        self.release(shm, unlink)
+        return array
+
+    def attach(self):
+        # the shared array itself, without a copy; it stays mapped until release()
+        if self.shm is None:
+            self.shm = shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def release(self, shm=None, unlink=True):
+        shm = shm or self.shm or shared_memory.SharedMemory(name=self.name)
+        shm.close()
+        if unlink:
+            shm.unlink()
+        self.shm = None
+
+
+def share(obj):
+    # Move the numeric payload of frames, series, return panels and dicts of them into shared memory
+    if isinstance(obj, dict):
+        return {key: share(value) for key, value in obj.items()}
+    if isinstance(obj, ReturnPanel):
+        return ('ReturnPanel', SharedArray(obj.values), obj.index, obj.columns)
+    if isinstance(obj, pd.DataFrame) and all(dtype.kind in 'biuf' for dtype in obj.dtypes):
+        return ('DataFrame', SharedArray(obj.values), obj.index, obj.columns)
+    if isinstance(obj, pd.Series) and obj.dtype.kind in 'biuf':
+        return ('Series', SharedArray(obj.values), obj.index, obj.name)
+    return obj
+
+
+def unshare(obj, unlink=False):
+    if isinstance(obj, dict):
+        return {key: unshare(value, unlink) for key, value in obj.items()}
+    if isinstance(obj, tuple) and len(obj) == 4 and isinstance(obj[1], SharedArray):
+        kind, array, index, labels = obj
+        if kind == 'DataFrame':
+            return pd.DataFrame(array.read(unlink), index=index, columns=labels)
+        if kind == 'ReturnPanel':
+            return ReturnPanel(array.read(unlink), index, labels)
+        return pd.Series(array.read(unlink), index=index, name=labels)
+    return obj
+
+
+def release(obj):
+    if isinstance(obj, dict):
+        for value in obj.values():
+            release(value)
+    elif isinstance(obj, tuple) and len(obj) == 4 and isinstance(obj[1], SharedArray):
+        obj[1].release()
+
+
+def run_shared(func, args, kwargs):
+    # Process-pool entry point: inputs and the return value travel through shared memory, and the metrics
+    # the node recorded in this worker go back with them
+    METRICS.reset(record=True)
+    args = [unshare(arg) for arg in args]
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return share(result), time.perf_counter() - start, METRICS.export()
+
+
+def run_local(func, args, kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start, None
+
+
+class InlineExecutor:
+    # Executor that runs each call as it is submitted, in the calling thread, so a profiler sees all of it
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as error:
+            future.set_exception(error)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+class DagExecutor:
+    # Runs a DAG of Nodes as soon as their dependencies finish. Nodes whose kind is in process_kinds go to
+    # a process pool of max_workers (max_workers=0 runs them on the thread pool instead); the rest go to a
+    # thread pool of max_threads (max_threads=0 runs them one by one in the calling thread).
+    # Per-node timings are collected in self.timings after run() and recorded as 'node' spans in METRICS.
+
+    def __init__(self, nodes, max_workers=PIPELINE_MAX_WORKERS, max_threads=FETCH_MAX_WORKERS,
+                 process_kinds=('indicator',)):
+        self.nodes = {node.name: node for node in nodes}
+        self.max_workers = max_workers
+        self.max_threads = max_threads
+        self.process_kinds = process_kinds
+        self.validate()
+
+    def validate(self):
+        for node in self.nodes.values():
+            missing = [dep for dep in node.deps if dep not in self.nodes]
+            if missing:
+                raise ValueError('node %s depends on unknown nodes %s' % (node.name, missing))
+        visited, visiting = set(), set()
+
+        def visit(name):
+            if name in visiting:
+                raise ValueError('pipeline has a cycle through node %s' % name)
+            if name not in visited:
+                visiting.add(name)
+                for dep in self.nodes[name].deps:
+                    visit(dep)
+                visiting.remove(name)
+                visited.add(name)
+        for name in self.nodes:
+            visit(name)
+
+    def run(self):
+        results, shared, timings, futures = {}, {}, [], {}
+        start = time.perf_counter()
+        threads = ThreadPoolExecutor(max_workers=self.max_threads) if self.max_threads else InlineExecutor()
+        processes = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=process_context()) \
+            if self.max_workers else None
+        pending = dict(self.nodes)
+
+        def submit(node):
+            in_process = processes is not None and node.kind in self.process_kinds
+            if in_process:
+                for dep in node.deps:
+                    if dep not in shared:
+                        shared[dep] = share(results[dep])
+                future = processes.submit(run_shared, node.func, [shared[dep] for dep in node.deps], node.kwargs)
+            else:
+                future = threads.submit(run_local, node.func, [results[dep] for dep in node.deps], node.kwargs)
+            futures[future] = (node, time.perf_counter() - start, in_process)
+
+        try:
+            while pending or futures:
+                for name in [name for name, node in pending.items() if all(dep in results for dep in node.deps)]:
+                    submit(pending.pop(name))
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in done:
+                    node, submitted, in_process = futures.pop(future)
+                    result, seconds, metrics = future.result()
+                    results[node.name] = unshare(result, unlink=True) if in_process else result
+                    if metrics is not None:
+                        METRICS.merge(metrics)
+                    METRICS.observe('node', seconds, node=node.name, kind=node.kind,
+                                    worker='process' if in_process else 'thread')
+                    timings.append({'node': node.name,
+                                    'kind': node.kind,
+                                    'worker': 'process' if in_process else 'thread',
+                                    'submitted': submitted,
+                                    'finished': time.perf_counter() - start,
+                                    'seconds': seconds})
+        finally:
+            threads.shutdown(wait=True)
+            if processes is not None:
+                processes.shutdown(wait=True, cancel_futures=True)
+            for value in shared.values():
+                release(value)
+        self.timings = pd.DataFrame(timings).set_index('node')
+        return results
@@ -1,39 +1,231 @@
 
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
 import pandas as pd
-from openbb_terminal.sdk import openbb
 from constants import *
-from urllib import request
+from urllib import parse, request
+from price_cache import PriceCache
+from instrumentation import METRICS
 
-def get_fred_data(macro_tickers, start_date, end_date):
-    macro_data = openbb.economy.fred(macro_tickers, start_date=start_date, end_date=end_date)
+PRICE_CACHE = PriceCache()
+
+
+def fetch_fred_data(macro_tickers, start_date, end_date):
+    # openbb is imported on first use, so the fetch machinery (and its tests) work without it
+    from openbb_terminal.sdk import openbb
+    with METRICS.span('fetch', source=FRED_DATA_SOURCE):
+        macro_data = openbb.economy.fred(macro_tickers, start_date=start_date, end_date=end_date)
     return macro_data[0]
 
 
-def get_yahoo_data(etf_tickers, start_date, end_date):
-    etf_data = pd.DataFrame()
-    for ticker in etf_tickers:
+def get_fred_data(macro_tickers, start_date, end_date, cache=PRICE_CACHE):
+    return cache.get_frame(FRED_DATA_SOURCE, macro_tickers, fetch_fred_data, start_date, end_date)
+
+
+def load_yahoo_ticker(ticker, start_date, end_date):
+    from openbb_terminal.sdk import openbb
+    with METRICS.span('fetch', source=YAHOO_DATA_SOURCE):
         ticker_data = openbb.stocks.load(ticker,
                                          start_date=str(start_date),
                                          end_date=str(end_date),
                                          source=YAHOO_DATA_SOURCE)['Adj Close']
-        ticker_data.name = ticker
-        etf_data = pd.concat([etf_data, ticker_data], axis=1)
-        etf_data.dropna(how='any', inplace=True)
-    return etf_data
+    ticker_data.name = ticker
+    return ticker_data
+
+
+def fetch_concurrently(load, tickers, max_workers=FETCH_MAX_WORKERS, retries=FETCH_RETRIES, timeout=FETCH_TIMEOUT,
+                       backoff=FETCH_BACKOFF):
+    # Run load(ticker) with at most `max_workers` attempts in flight. Attempts are handed to the pool only when
+    # a slot is free, so each gets `timeout` seconds from submission (not while it waits for a slot); failed or
+    # timed-out attempts are resubmitted after an exponential backoff until `retries` attempts have been used.
+    # A timed-out attempt cannot be interrupted: its thread is abandoned and frees its slot, and the pool keeps
+    # spare threads for every attempt that can be abandoned, so stalled loads never starve the queue.
+    pool = ThreadPoolExecutor(max_workers=max_workers + len(tickers) * max(retries - 1, 0))
+    futures, deadlines, attempts, results = {}, {}, {}, {}
+    pending = [(ticker, 0.) for ticker in tickers]  # (ticker, earliest submission time)
+
+    def submit_ready():
+        now = time.monotonic()
+        for ticker, not_before in list(pending):
+            if len(futures) >= max_workers:
+                break
+            if not_before <= now:
+                pending.remove((ticker, not_before))
+                attempts[ticker] = attempts.get(ticker, 0) + 1
+                deadlines[ticker] = now + timeout
+                futures[ticker] = pool.submit(load, ticker)
+
+    def retry(ticker, error):
+        METRICS.count('fetch_retries')
+        if attempts[ticker] >= retries:
+            raise RuntimeError('failed to fetch %s after %d attempts' % (ticker, attempts[ticker])) from error
+        pending.append((ticker, time.monotonic() + backoff * 2 ** (attempts[ticker] - 1)))
+
+    try:
+        while futures or pending:
+            submit_ready()
+            # wake for the next completion or deadline, or a backoff expiry if a slot is free
+            wake = [deadlines[ticker] for ticker in futures]
+            if len(futures) < max_workers:
+                wake += [not_before for _, not_before in pending]
+            wake = min(wake)
+            delay = max(0., wake - time.monotonic())
+            if futures:
+                wait(futures.values(), timeout=delay, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(delay)
+            for ticker, future in list(futures.items()):
+                if future.done():
+                    del futures[ticker]
+                    if future.exception() is None:
+                        results[ticker] = future.result()
+                    else:
+                        retry(ticker, future.exception())
+                elif time.monotonic() >= deadlines[ticker]:
+                    del futures[ticker]
+                    retry(ticker, TimeoutError('fetching %s timed out after %ss' % (ticker, timeout)))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return [results[ticker] for ticker in tickers]
+
+
+def fetch_yahoo_data(etf_tickers, start_date, end_date, max_workers=FETCH_MAX_WORKERS, load=load_yahoo_ticker):
+    etf_data = fetch_concurrently(lambda ticker: load(ticker, start_date, end_date), etf_tickers,
+                                  max_workers=max_workers)
+    return pd.concat(etf_data, axis=1)
+
+
+def align_prices(prices, alignment='inner', min_start_dates=None):
+    # inner: keep dates on which every ticker has a price (the original behaviour)
+    # ffill: outer join, carry prices forward; rows before a ticker's first price stay NaN
+    # min_start: drop tickers whose history starts after their minimum start date (one date for all
+    #            tickers, or a dict by ticker), then forward-fill from the latest start among the rest
+    if alignment == 'inner':
+        return prices.dropna(how='any')
+    if alignment == 'ffill':
+        return prices.ffill()
+    if alignment != 'min_start':
+        raise ValueError("alignment must be 'inner', 'ffill' or 'min_start', got %r" % alignment)
+    if not isinstance(min_start_dates, dict):
+        min_start_dates = {ticker: min_start_dates for ticker in prices.columns}
+    first_dates = prices.apply(lambda x: x.first_valid_index())
+    keep = [ticker for ticker in prices.columns
+            if min_start_dates.get(ticker) is None or first_dates[ticker] <= pd.Timestamp(min_start_dates[ticker])]
+    prices = prices[keep].ffill()
+    return prices.loc[first_dates[keep].max():]
+
+
+def get_yahoo_data(etf_tickers, start_date, end_date, alignment='inner', min_start_dates=None,
+                   max_workers=FETCH_MAX_WORKERS, cache=PRICE_CACHE):
+    fetch = lambda tickers, start, end: fetch_yahoo_data(tickers, start, end, max_workers=max_workers)
+    etf_data = cache.get_frame(YAHOO_DATA_SOURCE, etf_tickers, fetch, start_date, end_date)
+    return align_prices(etf_data, alignment=alignment, min_start_dates=min_start_dates)
 
-def get_shiller_data(url, sheet_name, skiprows):
-    df = pd.read_excel(request.urlretrieve(url)[0], sheet_name=sheet_name, skiprows=skiprows)
+
+def source_path(url):
+    # local workbooks (a path or file:// URL) stand in for the Shiller download, e.g. offline or in tests
+    parsed = parse.urlparse(url)
+    if parsed.scheme == 'file':
+        return request.url2pathname(parsed.path)
+    return None if parsed.scheme in ('http', 'https') else url
+
+
+def source_validators(url):
+    # Cheap change markers for a source: mtime and size of a local file, ETag / Last-Modified of a URL
+    # (one HEAD request). None if the server sends neither, in which case the content hash decides.
+    path = source_path(url)
+    if path is not None:
+        stat = os.stat(path)
+        return {'mtime': stat.st_mtime, 'size': stat.st_size}
+    try:
+        with request.urlopen(request.Request(url, method='HEAD'), timeout=FETCH_TIMEOUT) as response:
+            validators = {'etag': response.headers.get('ETag'),
+                          'last_modified': response.headers.get('Last-Modified')}
+    except OSError:
+        return None
+    validators = {name: value for name, value in validators.items() if value}
+    return validators or None
+
+
+def source_format(url):
+    # a .csv source is read as a CSV export of the sheet (same rows and columns), any other as a workbook
+    return 'csv' if parse.urlparse(url).path.lower().endswith('.csv') else 'excel'
+
+
+def read_source(url):
+    path = source_path(url)
+    if path is not None:
+        with open(path, 'rb') as f:
+            return f.read()
+    with request.urlopen(url, timeout=FETCH_TIMEOUT) as response:
+        return response.read()
+
+
+def fetch_shiller_data(url, sheet_name, skiprows):
+    with METRICS.span('fetch', source=SHILLER_DATA_SOURCE):
+        content = read_source(url)
+    with METRICS.span('transform', step='shiller_parse'):
+        return parse_shiller_data(io.BytesIO(content), sheet_name, skiprows, file_format=source_format(url))
+
+
+def parse_shiller_data(path, sheet_name, skiprows, file_format='excel'):
+    if file_format == 'csv':
+        df = pd.read_csv(path, skiprows=skiprows)
+    else:
+        df = pd.read_excel(path, sheet_name=sheet_name, skiprows=skiprows)
     df.drop(index=df.index[:2], axis=0, inplace=True)
     df.drop(index=df.index[-1],axis=0, inplace=True)
-    df['Unnamed: 0'] = df['Unnamed: 0'].astype(str).str.replace('\.1$', '.10')
-    df['Unnamed: 0'] = df['Unnamed: 0'].astype(str).str.replace('.', '-')
-    df.set_index('Unnamed: 0', inplace=True)
-    df.index.rename('Date', inplace=True)
-    df.index = pd.to_datetime(df.index)
+    # dates are year.month numbers, with October stored as .1
+    dates = pd.to_numeric(df.pop('Unnamed: 0')).to_numpy(dtype=float)
+    years = np.floor(dates).astype(int)
+    months = np.rint((dates - years) * 100).astype(int)
+    df.index = pd.DatetimeIndex(pd.to_datetime({'year': years, 'month': months, 'day': 1}), name='Date')
     df['S&P'] = df['S&P'].astype(float)
     return df
 
 
+def ingest_shiller_data(url, sheet_name, skiprows, columns, cache=PRICE_CACHE):
+    # Parse the workbook into the cache only when it changed. Stale entries are revalidated against the
+    # version they were parsed from: unchanged validators (or, once downloaded, unchanged content) just
+    # mark them fresh; otherwise the columns are re-parsed and replaced.
+    stale = [column for column in columns if not cache.covers_start(SHILLER_DATA_SOURCE, column, None)
+             or cache.is_stale(SHILLER_DATA_SOURCE, column)]
+    if not stale:
+        return
+    known = [cache.version(SHILLER_DATA_SOURCE, column) for column in columns]
+    known = known[0] if all(version == known[0] for version in known) else None
+    validators = source_validators(url)
+    if known is not None and validators is not None and known.get('validators') == validators:
+        METRICS.count('source_unchanged', source=SHILLER_DATA_SOURCE, check='validators')
+        for column in columns:
+            cache.touch(SHILLER_DATA_SOURCE, column)
+        return
+    with METRICS.span('fetch', source=SHILLER_DATA_SOURCE):
+        content = read_source(url)
+    version = {'validators': validators, 'sha1': hashlib.sha1(content).hexdigest()}
+    if known is not None and known.get('sha1') == version['sha1']:
+        METRICS.count('source_unchanged', source=SHILLER_DATA_SOURCE, check='sha1')
+        for column in columns:
+            cache.touch(SHILLER_DATA_SOURCE, column, version=version)
+        return
+    METRICS.count('source_changed', source=SHILLER_DATA_SOURCE)
+    with METRICS.span('transform', step='shiller_parse'):
+        df = parse_shiller_data(io.BytesIO(content), sheet_name, skiprows, file_format=source_format(url))
+    for column in columns:
+        cache.store(SHILLER_DATA_SOURCE, column, df[column], version=version)
+
+
+def get_shiller_data(url, sheet_name, skiprows, columns=SHILLER_COLUMNS, cache=PRICE_CACHE):
+    # the workbook is one file: it is parsed into the cache once per change and read back memory-mapped
+    columns = list(columns)
+    ingest_shiller_data(url, sheet_name, skiprows, columns, cache=cache)
+    fetch = lambda tickers, start_date, end_date: fetch_shiller_data(url, sheet_name, skiprows)[tickers]
+    return cache.get_frame(SHILLER_DATA_SOURCE, columns, fetch)
+
 
 if __name__=="__main__":
     # get_fred_data(['INDPRO', 'PAYEMS'], start_date=START_DATE, end_date=END_DATE)
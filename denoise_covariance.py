@@ -5,10 +5,14 @@ from scipy.optimize import minimize
 
 class DenoiseCovariance:
 
-    def __init__(self, cov, q, bwidth):
+    def __init__(self, cov, q, bwidth, var0=.5, kde_points=2048):
+        # cov is one covariance matrix or a (W x N x N) stack of them; fits on a stack are warm-started
+        # from the previous matrix's fitted variance, beginning at var0
         self.cov = cov
         self.q = q
         self.bwidth = bwidth
+        self.var0 = var0
+        self.kde_points = kde_points
 
     def mpPDF(self, var, q, pts):
         # Marcenko-Pasture pdf
@@ -43,6 +47,26 @@ class DenoiseCovariance:
         pdf = pd.Series(np.exp(logProb), index=x.flatten())
         return pdf
 
+    def gaussianKDE(self, obs, bWidth, x):
+        # Gaussian kernel density of obs at x as one vectorized sum (same density as fitKDE)
+        z = (np.reshape(x, (-1, 1)) - np.reshape(obs, (1, -1))) / bWidth
+        return np.exp(-.5 * z ** 2).sum(axis=1) / (len(obs) * bWidth * np.sqrt(2 * np.pi))
+
+    def kdeGrid(self, eVal, q, bWidth):
+        # Empirical pdf tabulated once per eigenvalue set over every point the MP fit can ask for:
+        # eMax is largest at var = 1
+        x = np.linspace(0., (1 + (1. / q) ** .5) ** 2, self.kde_points)
+        return x, self.gaussianKDE(eVal, bWidth, x)
+
+    def errPDFsGrid(self, var, q, kde_x, kde_pdf, pts=1000):
+        # Same fit error as errPDFs with the empirical pdf interpolated from kdeGrid
+        var = float(np.ravel(var)[0])
+        eMin, eMax = var * (1 - (1. / q) ** .5) ** 2, var * (1 + (1. / q) ** .5) ** 2
+        eVal = np.linspace(eMin, eMax, pts)
+        pdf0 = q / (2 * np.pi * var * eVal) * ((eMax - eVal) * (eVal - eMin)) ** .5
+        pdf1 = np.interp(eVal, kde_x, kde_pdf)
+        return np.sum((pdf1 - pdf0) ** 2)
+
     def errPDFs(self, var, eVal, q, bWidth, pts=1000):
         # Fit error
         pdf0 = self.mpPDF(var, q, pts)  # theoretical pdf
@@ -50,9 +74,10 @@ class DenoiseCovariance:
         sse = np.sum((pdf1 - pdf0) ** 2)
         return sse
 
-    def findMaxEval(self, eVal, q, bWidth):
+    def findMaxEval(self, eVal, q, bWidth, x0=.5):
         # Find max random eVal by fitting Mercenko's dist
-        out = minimize(lambda *x: self.errPDFs(*x), .5, args=(eVal, q, bWidth), bounds=((1E-5, 1 - 1E-5),))
+        kde_x, kde_pdf = self.kdeGrid(eVal, q, bWidth)
+        out = minimize(lambda *x: self.errPDFsGrid(*x), x0, args=(q, kde_x, kde_pdf), bounds=((1E-5, 1 - 1E-5),))
         if out['success']:
             var = out['x'][0]
         else:
@@ -81,10 +106,33 @@ class DenoiseCovariance:
         return cov
 
     def deNoiseCov(self):
+        if np.ndim(self.cov) == 3:
+            return self.deNoiseCovs()
         corr0 = self.cov2corr(self.cov)
         eVal0, eVec0 = self.getPCA(corr0)
-        eMax0, var0 = self.findMaxEval(np.diag(eVal0), self.q, self.bwidth)
+        eMax0, var0 = self.findMaxEval(np.diag(eVal0), self.q, self.bwidth, x0=self.var0)
         nFacts0 = eVal0.shape[0] - np.diag(eVal0)[::-1].searchsorted(eMax0)
         corr1 = self.denoisedCorr(eVal0, eVec0, nFacts0)
         cov1 = self.corr2cov(corr1, np.diag(self.cov) ** .5)
-        return cov1
\ No newline at end of file
+        return cov1
+
+    def deNoiseCovs(self):
+        # Stack version of deNoiseCov: one batched eigh, then a warm-started MP fit per matrix.
+        # self.var0 is left at the last fitted variance so the next stack continues the warm start.
+        covs = np.asarray(self.cov, dtype=np.float64)
+        std = np.sqrt(np.diagonal(covs, axis1=-2, axis2=-1))
+        corr0 = np.clip(covs / (std[:, :, None] * std[:, None, :]), -1, 1)
+        eVal0, eVec0 = np.linalg.eigh(corr0)
+        eVal0, eVec0 = eVal0[:, ::-1].copy(), eVec0[:, :, ::-1]
+        n = eVal0.shape[1]
+        for i in range(len(eVal0)):
+            eMax0, var0 = self.findMaxEval(eVal0[i], self.q, self.bwidth, x0=self.var0)
+            if var0 < 1:
+                self.var0 = var0
+            nFacts0 = n - eVal0[i][::-1].searchsorted(eMax0)
+            if nFacts0 < n:
+                eVal0[i, nFacts0:] = eVal0[i, nFacts0:].sum() / float(n - nFacts0)
+        corr1 = np.matmul(eVec0 * eVal0[:, None, :], np.swapaxes(eVec0, -1, -2))
+        std1 = np.sqrt(np.diagonal(corr1, axis1=-2, axis2=-1))
+        corr1 = np.clip(corr1 / (std1[:, :, None] * std1[:, None, :]), -1, 1)
+        return corr1 * (std[:, :, None] * std[:, None, :])
\ No newline at end of file
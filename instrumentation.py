@@ -0,0 +1,216 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from constants import REFRESH_LOG, PROFILE_DIR, PROFILE_REFRESH
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_bytes():
+    # peak resident set size of this process so far (ru_maxrss is in kB on Linux, bytes on macOS)
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def current_rss_bytes():
+    # resident set size now: /proc on Linux, else psutil if installed, else 0
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return 0
+    return psutil.Process().memory_info().rss
+
+
+def label_text(labels):
+    escaped = ['%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in labels]
+    return '{' + ','.join(escaped) + '}' if escaped else ''
+
+
+def new_span():
+    return {'count': 0, 'seconds': 0., 'max_seconds': 0., 'max_rss_growth_bytes': 0, 'max_peak_rss_growth_bytes': 0}
+
+
+class Metrics:
+    # Process-wide timing/memory spans and counters for the refresh pipeline.
+    # Spans are aggregated by (name, labels); while a refresh is recorded each span is also kept as an event for
+    # its structured log line. Pipeline worker processes record into their own instance and send export()
+    # back with the node result, which the parent merge()s.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profile_requested = False
+        self.last_profile = None
+        self.reset()
+
+    def reset(self, record=False):
+        with self.lock:
+            self.spans = {}
+            self.counters = {}
+            self.events = [] if record else None
+
+    @contextlib.contextmanager
+    def span(self, name, **labels):
+        # memory is recorded as the span's own change in resident memory (rss_growth) and how far it raised
+        # the process's peak (peak_rss_growth); spans running in other threads at the same time share both
+        start, rss, peak = time.perf_counter(), current_rss_bytes(), peak_rss_bytes()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, rss_growth=current_rss_bytes() - rss,
+                         peak_rss_growth=peak_rss_bytes() - peak, **labels)
+
+    def observe(self, name, seconds, rss_growth=0, peak_rss_growth=0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            span = self.spans.setdefault(key, new_span())
+            span['count'] += 1
+            span['seconds'] += seconds
+            span['max_seconds'] = max(span['max_seconds'], seconds)
+            span['max_rss_growth_bytes'] = max(span['max_rss_growth_bytes'], rss_growth)
+            span['max_peak_rss_growth_bytes'] = max(span['max_peak_rss_growth_bytes'], peak_rss_growth)
+            if self.events is not None:
+                self.events.append(dict(labels, span=name, seconds=round(seconds, 6), rss_growth_bytes=rss_growth,
+                                        peak_rss_growth_bytes=peak_rss_growth))
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def export(self):
+        with self.lock:
+            return {'spans': {key: dict(span) for key, span in self.spans.items()},
+                    'counters': dict(self.counters),
+                    'events': list(self.events or [])}
+
+    def merge(self, exported):
+        with self.lock:
+            for key, other in exported['spans'].items():
+                span = self.spans.setdefault(key, new_span())
+                span['count'] += other['count']
+                span['seconds'] += other['seconds']
+                for field in ['max_seconds', 'max_rss_growth_bytes', 'max_peak_rss_growth_bytes']:
+                    span[field] = max(span[field], other[field])
+            for key, value in exported['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            if self.events is not None:
+                self.events.extend(exported['events'])
+
+    def prometheus_text(self, prefix='riskmonitor'):
+        # Prometheus text exposition format (0.0.4)
+        with self.lock:
+            spans, counters = dict(self.spans), dict(self.counters)
+        lines = []
+        for metric, field, kind in [('span_seconds_total', 'seconds', 'counter'),
+                                    ('span_count_total', 'count', 'counter'),
+                                    ('span_max_seconds', 'max_seconds', 'gauge'),
+                                    ('span_max_rss_growth_bytes', 'max_rss_growth_bytes', 'gauge'),
+                                    ('span_max_peak_rss_growth_bytes', 'max_peak_rss_growth_bytes', 'gauge')]:
+            lines.append('# TYPE %s_%s %s' % (prefix, metric, kind))
+            for (name, labels), span in sorted(spans.items()):
+                lines.append('%s_%s%s %r' % (prefix, metric, label_text((('span', name),) + labels), span[field]))
+        for name in sorted({name for name, _ in counters}):
+            lines.append('# TYPE %s_%s_total counter' % (prefix, name))
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append('%s_%s_total%s %r' % (prefix, name, label_text(labels), value))
+        lines.append('# TYPE %s_peak_rss_bytes gauge' % prefix)
+        lines.append('%s_peak_rss_bytes %d' % (prefix, peak_rss_bytes()))
+        return '\n'.join(lines) + '\n'
+
+    @contextlib.contextmanager
+    def refresh(self, log_path=REFRESH_LOG):
+        # Record one refresh: its spans as events, the counters it moved, and its outcome, written as one
+        # JSON line to log_path and to the log
+        with self.lock:
+            self.events = []
+            counters_before = dict(self.counters)
+        self.last_profile = None
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        start, rss, peak = time.perf_counter(), current_rss_bytes(), peak_rss_bytes()
+        status = 'failed'
+        try:
+            yield
+            status = 'ok'
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe('refresh', seconds, rss_growth=current_rss_bytes() - rss,
+                         peak_rss_growth=peak_rss_bytes() - peak, status=status)
+            self.count('refreshes', status=status)
+            with self.lock:
+                events, self.events = self.events, None
+                counters = [dict(labels, counter=name, value=value - counters_before.get((name, labels), 0))
+                            for (name, labels), value in self.counters.items()
+                            if value != counters_before.get((name, labels), 0)]
+            record = {'started_at': started_at.isoformat(), 'seconds': round(seconds, 6), 'status': status,
+                      'peak_rss_bytes': peak_rss_bytes(),
+                      'profile': self.last_profile,
+                      'spans': events, 'counters': counters}
+            line = json.dumps(record, default=str)
+            logger.info('refresh metrics %s', line)
+            if log_path:
+                os.makedirs(os.path.dirname(log_path), exist_ok=True)
+                with open(log_path, 'a') as f:
+                    f.write(line + '\n')
+
+    def request_profile(self):
+        self.profile_requested = True
+
+    def take_profile_request(self):
+        requested, self.profile_requested = self.profile_requested, False
+        return requested or PROFILE_REFRESH
+
+    @contextlib.contextmanager
+    def profile(self, enabled, profile_dir=PROFILE_DIR):
+        # Capture the hot path of the enclosed code with pyinstrument (HTML) if installed, else cProfile (.prof)
+        if not enabled:
+            yield
+            return
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, 'refresh-' + datetime.datetime.now().strftime('%Y%m%dT%H%M%S.%f'))
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            Profiler = None
+        if Profiler is None:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = Profiler()
+            profiler.start()
+        try:
+            yield
+        finally:
+            if Profiler is None:
+                profiler.disable()
+                path += '.prof'
+                profiler.dump_stats(path)
+            else:
+                profiler.stop()
+                path += '.html'
+                with open(path, 'w') as f:
+                    f.write(profiler.output_html())
+            self.last_profile = path
+            logger.info('refresh profile written to %s', path)
+
+
+METRICS = Metrics()
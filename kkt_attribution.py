@@ -1,7 +1,7 @@
 import numpy as np
 import pandas as pd
-from scipy.spatial import distance
-from data_fetchers import get_fred_data, get_shiller_data
+from scipy.linalg import cho_solve
+from scipy.special import logsumexp
 from constants import *
 
 class KKT_Attribution:
@@ -12,45 +12,62 @@ class KKT_Attribution:
         self.means_r = self.df.groupby(recession_var)[self.econ_vars].mean()
         self.cov_r = self.df.groupby(recession_var)[self.econ_vars].cov()
         self.regimes = self.means_r.index.values.tolist()
+        self.factor_regime_covariances()
         self.calculate_mahalanobis_distance_by_regime()
         self.calculate_statistical_likelihood()
         self.calculate_sensitivities()
         self.calculate_variable_importance()
 
+    def factor_regime_covariances(self):
+        # One Cholesky factor and log-determinant of 2*pi*cov per regime, reused for every row
+        self.chol_r = {}
+        self.log_det_r = {}
+        for r in self.regimes:
+            chol = np.linalg.cholesky(self.cov_r.loc[r].loc[self.econ_vars, self.econ_vars].values)
+            self.chol_r[r] = chol
+            self.log_det_r[r] = len(self.econ_vars) * np.log(2 * np.pi) + 2 * np.log(np.diag(chol)).sum()
+
+    def regime_deviations(self, r):
+        return self.df[self.econ_vars].values.astype(np.float64) - self.means_r.loc[r, self.econ_vars].values
+
     def calculate_mahalanobis_distance_by_regime(self):
+        # scipy's mahalanobis(u, v, VI) was given the covariance as VI, i.e. sqrt(d' cov d) = ||L' d||
         for r in self.regimes:
-            self.df['Distance' + str(r)] = self.df.apply(lambda x: distance.mahalanobis(x[self.econ_vars],
-                                                                                        self.means_r.loc[r],
-                                                                                        self.cov_r.loc[r]), axis=1)
+            self.df['Distance' + str(r)] = np.sqrt((self.regime_deviations(r).dot(self.chol_r[r]) ** 2).sum(axis=1))
 
     def calculate_statistical_likelihood(self):
-        for r in self.regimes:
-            self.df['Likelihood' + str(r)] = self.df.apply(lambda x:
-                                                           np.linalg.det(2 * np.pi * self.cov_r.loc[r]) ** (
-                                                               -0.5) * np.exp(-x['Distance' + str(r)] / 2),
-                                                           axis=1)
-        total_likelihoods = self.df[self.df.columns[self.df.columns.str.contains('Likelihood')]].sum(axis=1)
-        for r in self.regimes:
-            self.df['Probability' + str(r)] = self.df['Likelihood' + str(r)] / total_likelihoods
+        log_likelihoods = np.column_stack([-0.5 * self.log_det_r[r] - 0.5 * self.df['Distance' + str(r)].values
+                                           for r in self.regimes])
+        log_total = logsumexp(log_likelihoods, axis=1)
+        for i, r in enumerate(self.regimes):
+            self.df['LogLikelihood' + str(r)] = log_likelihoods[:, i]
+            self.df['Likelihood' + str(r)] = np.exp(log_likelihoods[:, i])
+        for i, r in enumerate(self.regimes):
+            self.df['Probability' + str(r)] = np.exp(log_likelihoods[:, i] - log_total)
 
     def calculate_sensitivities(self):
+        # partial derivatives inv(cov_r).(x - mean_r) for all rows at once, as (T x K) frames
+        self.partial_derivs = {}
         for r in self.regimes:
-            self.df['PartialDeriv' + str(r)] = self.df.apply(
-                lambda x: np.dot(np.linalg.inv(self.cov_r.loc[r]), (x[self.econ_vars] - self.means_r.loc[r]).T), axis=1)
+            partial_derivs = cho_solve((self.chol_r[r], True), self.regime_deviations(r).T).T
+            self.partial_derivs[r] = pd.DataFrame(partial_derivs, index=self.df.index, columns=self.econ_vars)
+        probabilities = {r: self.df['Probability' + str(r)].values[:, None] for r in self.regimes}
+        self.sensitivities = {}
         for r in self.regimes:
             not_r = [x for x in self.regimes if x != r]
-            self.df['Sensitivity' + str(r)] = (1 / len(self.regimes)) * abs(self.df['Probability' + str(r)].T * sum(
-                self.df['Probability' + str(z)] * self.df['PartialDeriv' + str(z)] for z in not_r) - (1 - self.df[
-                'Probability' + str(r)] * self.df['PartialDeriv' + str(r)]))
-        self.df['Sensitivity'] = self.df[self.df.columns[self.df.columns.str.contains('Sensitivity')]].sum(axis=1)
+            sensitivity = (1 / len(self.regimes)) * abs(probabilities[r] * sum(
+                probabilities[z] * self.partial_derivs[z].values for z in not_r) - (1 - probabilities[r] *
+                                                                                    self.partial_derivs[r].values))
+            self.sensitivities[r] = pd.DataFrame(sensitivity, index=self.df.index, columns=self.econ_vars)
+        self.sensitivity = sum(self.sensitivities[r] for r in self.regimes)
 
     def calculate_variable_importance(self):
         sigma = self.df[self.econ_vars].std()
-        self.variable_importance = pd.DataFrame(index=self.df.index, columns=self.econ_vars)
-        for dt, y in self.df['Sensitivity'].iteritems():
-            self.variable_importance.loc[dt, :] = (y.flatten() * sigma) / sum(abs(y.flatten() * sigma))
+        weighted = self.sensitivity * sigma
+        self.variable_importance = weighted.div(weighted.abs().sum(axis=1), axis=0).astype(np.float64)
 
 if __name__ =="__main__":
+    from data_fetchers import get_fred_data, get_shiller_data
     kkt_data = get_fred_data(KKT_BUSINESS_CYCLE_INDICATOR_SERIES, start_date=None, end_date=END_DATE)
     kkt_data[[INDUSTRIAL_PRODCUTION, NONFARM_PAYROLLS]] = kkt_data[
         [INDUSTRIAL_PRODCUTION, NONFARM_PAYROLLS]].pct_change(12).dropna()
@@ -2,30 +2,63 @@
 import dash
 from dash import dcc, html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
-from data_fetchers import get_yahoo_data, get_shiller_data, get_fred_data
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from constants import *
-from absorptionratio import AbsorptionRatio
-from turbulence import Turbulence
-from kkt_attribution import KKT_Attribution
-from visuals import PlotMaker
-import pandas as pd
+from pipeline import compute_indicators
+from results_store import ResultsStore, RefreshScheduler
+from instrumentation import METRICS
+from flask import Response
+from visuals import PlotMaker, decimate
+from streaming_service import CSVBarSource, StreamingService
 import plotly.graph_objs as go
 import plotly.io as pio
 
+# indicator series are computed off the request path and read back from the store
+results_store = ResultsStore()
+refresh_scheduler = RefreshScheduler(lambda: compute_indicators(results_store))
+# intraday indicators streamed from replayed minute bars, when a bar file is configured
+stream_service = None if STREAM_CSV is None else StreamingService(CSVBarSource(STREAM_CSV,
+                                                                                 interval=STREAM_BAR_INTERVAL))
+
 # plotly app creation code
 # Build the app components
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
+
+# Prometheus scrape target for the refresh and figure metrics
+@app.server.route('/metrics')
+def metrics():
+    return Response(METRICS.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+
+# run a profiled refresh now (the profile is written to PROFILE_DIR)
+@app.server.route('/profile')
+def profile():
+    METRICS.request_profile()
+    refresh_scheduler.trigger()
+    return Response('profiling a refresh, see %s\n' % PROFILE_DIR, mimetype='text/plain')
+
+
 submit = [
     html.Button("Submit", id="submit-button"),
 ]
 
+stream_rows = [] if stream_service is None else [
+    dcc.Interval(id='stream-poll', interval=STREAM_POLL_INTERVAL),
+    dbc.Row([dbc.Col([dcc.Graph(id='stream-turbulence')], width=20),
+             dbc.Col([dcc.Graph(id='stream-absorption-ratio')], width=20)]),
+]
+
 # Combine the form elements and placeholders for visualizations to form the app layout.
 app.layout = dbc.Container(
     [
         html.H1("Risk Dashboard"),
         dbc.Row([dbc.Col(submit)]),
+        html.Div(id='last-computed'),
+        dcc.Interval(id='results-poll', interval=DASHBOARD_POLL_INTERVAL),
+        # computed_at of the results this page shows
+        dcc.Store(id='shown-computed-at'),
         # Charts
         dbc.Row(
             [
@@ -39,7 +72,7 @@ app.layout = dbc.Container(
                 # dbc.Col([dcc.Graph(id="kkt-variable-importance-last10")], width=20),
             ]
         ),
-    ]
+    ] + stream_rows
 )
 
 # build the callback
@@ -53,98 +86,143 @@ app.layout = dbc.Container(
         Output("kkt-recession-probability", "figure"),
         Output("kkt-variable-importance","figure"),
         # Output("kkt-variable-importance-last10","figure"),
+        Output("last-computed", "children"),
+        Output("shown-computed-at", "data"),
     ],
-    [Input("submit-button", "n_clicks")],
-    [],
+    [Input("submit-button", "n_clicks"), Input("results-poll", "n_intervals")],
+    [State("shown-computed-at", "data")],
 )
 
 
-def foo(n_clicks):
-
-    # get sector data
-    sector_prices = get_yahoo_data(SECTORS,start_date=START_DATE, end_date=END_DATE)
-    sector_returns = sector_prices.pct_change().dropna()
-    # get asset class data
-    asset_prices = get_yahoo_data(ASSET_CLASSES,start_date=START_DATE, end_date=END_DATE)
-    asset_returns = asset_prices.pct_change().dropna()
-    # get robinson data
-    # robinson_prices = get_yahoo_data(ROBINSON_RATIO, start_date=START_DATE, end_date=END_DATE)
-    # get KKT data (fred and shiller then merge)
-    kkt_data = get_fred_data(KKT_BUSINESS_CYCLE_INDICATOR_SERIES, start_date=None, end_date=END_DATE)
-    kkt_data[[INDUSTRIAL_PRODCUTION, NONFARM_PAYROLLS]] = kkt_data[
-        [INDUSTRIAL_PRODCUTION, NONFARM_PAYROLLS]].pct_change(12).dropna()
-    kkt_data[TEN_YEAR_TREASURY_YIELD_MINUS_FF].ffill(inplace=True)
-    kkt_data[TEN_YEAR_TREASURY_YIELD_MINUS_FF] = kkt_data[TEN_YEAR_TREASURY_YIELD_MINUS_FF].rolling(
-        window=12).mean()
-    kkt_data.dropna(subset=[INDUSTRIAL_PRODCUTION, NONFARM_PAYROLLS, TEN_YEAR_TREASURY_YIELD_MINUS_FF], how='any',
-                    inplace=True)
-    shiller_data = get_shiller_data(SHILLER_URL, SHILLER_SHEET_NAME, SHILLER_SKIP_ROW)
-    sp500 = shiller_data['S&P'].copy()
-    sp500 = sp500.pct_change(12).dropna()
-    kkt_data = pd.merge(kkt_data, sp500, how='outer', left_index=True, right_index=True)
-    kkt_data.ffill(inplace=True)
-    kkt_data.dropna(how='any', inplace=True)
-
-    # calculate absorption ratios
-    sector_ar = AbsorptionRatio(sector_returns, window_size=WINDOW_SIZE)
-    asset_ar = AbsorptionRatio(asset_returns, window_size=WINDOW_SIZE)
-    # calculate turbulences
-    sector_turbulence = Turbulence(sector_returns, window_size=WINDOW_SIZE, quantile=TURBULENCE_QUANTILE)
-    asset_turbulence = Turbulence(asset_returns, window_size=WINDOW_SIZE ,quantile=TURBULENCE_QUANTILE)
-    # calculate robinson ratios
-
-    # calculate KKT indicator
-    kkt_attribution = KKT_Attribution(kkt_data, econ_vars=ECON_VARIABLES, recession_var=NBER_RECESSION)
+def foo(n_clicks, n_intervals, shown_computed_at):
+    # a poll only redraws when a newer publication exists, so idle viewers cost nothing and zoomed graphs
+    # keep their full-resolution patch
+    results, computed_at = results_store.latest()
+    if results is None:
+        return [go.Figure()] * 6 + ['Indicators are being computed, check back shortly.', None]
+    if dash.ctx.triggered_id == 'results-poll' and computed_at.isoformat() == shown_computed_at:
+        return [dash.no_update] * 8
+    with METRICS.span('figures'):
+        figures = build_figures(results)
+    return figures + ['Last computed at ' + computed_at.strftime('%Y-%m-%d %H:%M %Z'), computed_at.isoformat()]
 
 
+def build_figures(results):
+
     # Absorption Ratio plots
     # plot of multi-asset absorption ratio
-    asset_ar_plot = PlotMaker(asset_ar.absorption_ratio_standardized['Absorption_Ratio'], go_trace=go.Scatter, title='Asset Class Absorption Ratio',
+    asset_ar_plot = PlotMaker(results['asset_absorption_ratio'], go_trace=go.Scattergl, title='Asset Class Absorption Ratio',
               xaxis_title='Date', yaxis_title='Standardized Absorption Ratio', mode='lines+markers',
-              color='blue').plot
+              color='blue', max_points=PLOT_MAX_POINTS, decimation='lttb').plot
 
     # plot of spyder equity sector absorption ratio
-    sector_ar_plot = PlotMaker(sector_ar.absorption_ratio_standardized['Absorption_Ratio'], go_trace=go.Scatter, title='S&P Sector Absorption Ratio',
+    sector_ar_plot = PlotMaker(results['sector_absorption_ratio'], go_trace=go.Scattergl, title='S&P Sector Absorption Ratio',
               xaxis_title='Date', yaxis_title='Standardized Absorption Ratio', mode='lines+markers',
-              color='red').plot
+              color='red', max_points=PLOT_MAX_POINTS, decimation='lttb').plot
 
 
     # Turbulence plots
-    asset_turbulence_plot = PlotMaker(asset_turbulence.filtered_turbulence['Turbulence'], go_trace=go.Scatter, title='Asset Class Turbulence',
+    asset_turbulence_plot = PlotMaker(results['asset_turbulence'], go_trace=go.Scattergl, title='Asset Class Turbulence',
               xaxis_title='Date', yaxis_title='Turbulence', mode='lines',
-              color='blue').plot
-    sector_turbulence_plot = PlotMaker(sector_turbulence.filtered_turbulence['Turbulence'], go_trace=go.Scatter, title='S&P Sector Turbulence',
+              color='blue', max_points=PLOT_MAX_POINTS, decimation='minmax').plot
+    sector_turbulence_plot = PlotMaker(results['sector_turbulence'], go_trace=go.Scattergl, title='S&P Sector Turbulence',
               xaxis_title='Date', yaxis_title='Turbulence', mode='lines',
-              color='red').plot
+              color='red', max_points=PLOT_MAX_POINTS, decimation='minmax').plot
     # Adam Robinson Plot (single plot)
     # copper/gold and #LQD/IEF and dicret/staples
 
     # KKT Plots
     # plot recession probability 'Probability1.0'
-    kkt_recession_probability_plot = PlotMaker(kkt_attribution.df['Probability1.0'], go_trace=go.Scatter, title='KKT Recession Probability',
+    kkt_recession_probability_plot = PlotMaker(results['kkt_recession_probability'], go_trace=go.Scattergl, title='KKT Recession Probability',
               xaxis_title='Date', yaxis_title='Probability', mode='lines',
-              color='green').plot
+              color='green', max_points=PLOT_MAX_POINTS, decimation='lttb').plot
 
+    variable_importance = results['kkt_variable_importance']
     kkt_variable_importance_plot = go.Figure(layout=go.Layout(
         title='KKT Recession Probability Variable Importance',
         xaxis=dict(title='Date'),
         yaxis=dict(title='Variable Importance'), ), )
 
-    kkt_variable_importance_plot.add_trace(go.Bar(y=kkt_attribution.variable_importance[INDUSTRIAL_PRODCUTION].iloc[-121:], x=kkt_attribution.variable_importance.index[-121:],
+    kkt_variable_importance_plot.add_trace(go.Bar(y=variable_importance[INDUSTRIAL_PRODCUTION].iloc[-121:], x=variable_importance.index[-121:],
                                                   name=INDUSTRIAL_PRODCUTION, marker=dict(color='green')))
-    kkt_variable_importance_plot.add_trace(go.Bar(y=kkt_attribution.variable_importance[NONFARM_PAYROLLS].iloc[-121:],
-                                                  x=kkt_attribution.variable_importance.index[-121:],
+    kkt_variable_importance_plot.add_trace(go.Bar(y=variable_importance[NONFARM_PAYROLLS].iloc[-121:],
+                                                  x=variable_importance.index[-121:],
                                                   name=NONFARM_PAYROLLS, marker=dict(color='blue')))
-    kkt_variable_importance_plot.add_trace(go.Bar(y=kkt_attribution.variable_importance[TEN_YEAR_TREASURY_YIELD_MINUS_FF].iloc[-121:],
-                                                  x=kkt_attribution.variable_importance.index[-121:],
+    kkt_variable_importance_plot.add_trace(go.Bar(y=variable_importance[TEN_YEAR_TREASURY_YIELD_MINUS_FF].iloc[-121:],
+                                                  x=variable_importance.index[-121:],
                                                   name=TEN_YEAR_TREASURY_YIELD_MINUS_FF, marker=dict(color='yellow')))
-    kkt_variable_importance_plot.add_trace(go.Bar(y=kkt_attribution.variable_importance["S&P"].iloc[-121:],
-                                                  x=kkt_attribution.variable_importance.index[-121:],
+    kkt_variable_importance_plot.add_trace(go.Bar(y=variable_importance["S&P"].iloc[-121:],
+                                                  x=variable_importance.index[-121:],
                                                   name="S&P", marker=dict(color='red')))
     kkt_variable_importance_plot.update_layout(barmode='stack')
 
-    return asset_ar_plot, sector_ar_plot, asset_turbulence_plot, sector_turbulence_plot, kkt_recession_probability_plot, kkt_variable_importance_plot
+    # in the order of the callback outputs
+    return [sector_ar_plot, asset_ar_plot, sector_turbulence_plot, asset_turbulence_plot, kkt_recession_probability_plot, kkt_variable_importance_plot]
+
+
+# graph -> (results series, decimation) for re-fetching the visible range at full resolution on zoom
+ZOOMABLE_GRAPHS = {
+    'sector-absorption-ratio': ('sector_absorption_ratio', 'lttb'),
+    'asset-absorption-ratio': ('asset_absorption_ratio', 'lttb'),
+    'sector-turbulence': ('sector_turbulence', 'minmax'),
+    'asset-turbulence': ('asset_turbulence', 'minmax'),
+    'kkt-recession-probability': ('kkt_recession_probability', 'lttb'),
+}
+
+
+def zoom_figure(relayout_data, key, decimation):
+    # Patch the trace with the zoomed x range of the stored series, decimated only if still above PLOT_MAX_POINTS
+    results, _ = results_store.latest()
+    if results is None or not relayout_data:
+        raise PreventUpdate
+    if 'xaxis.range[0]' in relayout_data:
+        x_range = [relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']]
+    elif 'xaxis.range' in relayout_data:
+        x_range = relayout_data['xaxis.range']
+    elif relayout_data.get('xaxis.autorange'):
+        x_range = None
+    else:
+        raise PreventUpdate
+    series = decimate(results[key], PLOT_MAX_POINTS, decimation, x_range)
+    figure = dash.Patch()
+    figure['data'][0]['x'] = series.index
+    figure['data'][0]['y'] = series.values
+    if x_range is None:
+        figure['layout']['xaxis']['autorange'] = True
+    else:
+        figure['layout']['xaxis']['range'] = x_range
+    return figure
+
+
+for graph, (key, decimation) in ZOOMABLE_GRAPHS.items():
+    app.callback(Output(graph, 'figure', allow_duplicate=True), Input(graph, 'relayoutData'),
+                 prevent_initial_call=True)(
+        lambda relayout_data, key=key, decimation=decimation: zoom_figure(relayout_data, key, decimation))
+
+
+def stream_figures(n_intervals):
+    # the stream service's retained updates, redrawn on each poll
+    updates = stream_service.recent()
+    if updates.empty:
+        raise PreventUpdate
+    turbulence_plot = PlotMaker(updates['filtered_turbulence'], go_trace=go.Scattergl, title='Intraday Turbulence',
+                                xaxis_title='Time', yaxis_title='Turbulence', color='red',
+                                max_points=PLOT_MAX_POINTS, decimation='minmax').plot
+    absorption_ratio_plot = PlotMaker(updates['absorption_ratio'], go_trace=go.Scattergl,
+                                      title='Intraday Absorption Ratio', xaxis_title='Time',
+                                      yaxis_title='Absorption Ratio', color='blue', max_points=PLOT_MAX_POINTS,
+                                      decimation='lttb').plot
+    return [turbulence_plot, absorption_ratio_plot]
+
+
+if stream_service is not None:
+    app.callback([Output('stream-turbulence', 'figure'), Output('stream-absorption-ratio', 'figure')],
+                 [Input('stream-poll', 'n_intervals')])(stream_figures)
+
 
 if __name__ == "__main__":
+    refresh_scheduler.start()
+    if stream_service is not None:
+        stream_service.start()
     app.run_server()
 
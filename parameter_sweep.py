@@ -0,0 +1,79 @@
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from constants import PIPELINE_MAX_WORKERS, SWEEP_WINDOWS, SWEEP_QUANTILES
+from absorptionratio import AbsorptionRatio
+from turbulence import Turbulence
+from covariance_estimators import PrefixCovariances, DenoisedCovariance
+from return_panel import as_frame
+from dag import SharedArray, share, unshare, release, process_context
+
+# Calibration sweeps: turbulence and absorption ratio for many (window, quantile) settings at once.
+# The prefix sums of x and x.x' are built once and serve every window length; the quantiles of a window only
+# re-filter its turbulence. Windows are spread over a process pool whose workers read the returns and the prefix
+# sums from shared memory, so the (T + 1) x N x N prefix array exists once however many workers there are.
+
+SWEEP_COLUMNS = ['absorption_ratio', 'absorption_ratio_raw', 'turbulence', 'filtered_turbulence']
+
+# per worker process: the swept returns and their prefix sums
+worker_returns = None
+worker_covariances = None
+
+
+def sweep_window(returns, covariances, window_size, quantiles, denoise=False, bwidth=.01, short_window=21,
+                 long_window=252, min_periods=10):
+    # Tidy frame of one window's indicators indexed by (quantile, date)
+    estimator = DenoisedCovariance(covariances, bwidth=bwidth) if denoise else covariances
+    absorption_ratio = AbsorptionRatio(returns, window_size, short_window=short_window, long_window=long_window,
+                                       estimator=estimator)
+    turbulence = Turbulence(returns, window_size, quantile=quantiles[0], min_periods=min_periods,
+                            estimator=covariances)
+    index = turbulence.turbulence.index
+    frame = pd.DataFrame({'absorption_ratio': absorption_ratio.absorption_ratio_standardized['Absorption_Ratio'],
+                          'absorption_ratio_raw': absorption_ratio.absorption_ratio_raw['Absorption_Ratio'],
+                          'turbulence': turbulence.turbulence['Turbulence']}, index=index)
+    frames = []
+    for quantile in quantiles:
+        turbulence.quantile = quantile
+        frames.append(frame.assign(filtered_turbulence=turbulence.filter_turbulence()['Turbulence']))
+    return pd.concat(frames, keys=quantiles, names=['quantile', 'date'])
+
+
+def init_worker(shared_returns, shift, shared_sums, shared_cross, chunk_size):
+    global worker_returns, worker_covariances
+    worker_returns = as_frame(unshare(shared_returns))
+    worker_covariances = PrefixCovariances.from_arrays(worker_returns.index, shift, shared_sums.attach(),
+                                                       shared_cross.attach(), chunk_size=chunk_size)
+
+
+def run_worker(window_size, quantiles, kwargs):
+    return share(sweep_window(worker_returns, worker_covariances, window_size, quantiles, **kwargs))
+
+
+def sweep(returns, windows=SWEEP_WINDOWS, quantiles=SWEEP_QUANTILES, max_workers=PIPELINE_MAX_WORKERS,
+          chunk_size=256, **kwargs):
+    # Turbulence and absorption ratio for every (window, quantile) as one frame indexed by (window, quantile,
+    # date) with SWEEP_COLUMNS; absorption ratios repeat across quantiles. kwargs go to sweep_window.
+    # max_workers=0 runs every window in this process on one set of prefix sums.
+    returns = as_frame(returns)
+    windows, quantiles = sorted(windows), list(quantiles)
+    if max_workers == 0 or len(windows) == 1:
+        covariances = PrefixCovariances(returns, chunk_size=chunk_size)
+        frames = [sweep_window(returns, covariances, window_size, quantiles, **kwargs) for window_size in windows]
+    else:
+        n_obs, n_assets = returns.shape
+        shared_returns = share(returns)
+        shared_sums = SharedArray.zeros((n_obs + 1, n_assets))
+        shared_cross = SharedArray.zeros((n_obs + 1, n_assets, n_assets))
+        try:
+            shift = PrefixCovariances(returns, chunk_size=chunk_size, sums=shared_sums.attach(),
+                                      cross=shared_cross.attach()).shift
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(windows)), mp_context=process_context(),
+                                     initializer=init_worker, initargs=(shared_returns, shift, shared_sums,
+                                                                        shared_cross, chunk_size)) as pool:
+                futures = [pool.submit(run_worker, window_size, quantiles, kwargs) for window_size in windows]
+                frames = [unshare(future.result(), unlink=True) for future in futures]
+        finally:
+            release(shared_returns)
+            shared_sums.release()
+            shared_cross.release()
+    return pd.concat(frames, keys=windows, names=['window', 'quantile', 'date'])[SWEEP_COLUMNS]
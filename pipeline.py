@@ -0,0 +1,144 @@
+import logging
+import time
+import numpy as np
+import pandas as pd
+from data_fetchers import get_yahoo_data, get_shiller_data, get_fred_data
+from constants import *
+from absorptionratio import absorption_ratio_from_covariances, standardize_absorption_ratio
+from turbulence import turbulence_from_covariances, filter_turbulence
+from covariance_estimators import SampleCovariance, DenoisedCovariance, rolling_frame
+from kkt_attribution import KKT_Attribution
+from dag import Node, DagExecutor
+from return_panel import ReturnPanel, as_frame
+from instrumentation import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_kkt_data(kkt_data, shiller_data):
+    # KKT inputs: 12m growth of IP and payrolls, 12m average of the 10y-FF spread, 12m S&P return
+    kkt_data[[INDUSTRIAL_PRODCUTION, NONFARM_PAYROLLS]] = kkt_data[
+        [INDUSTRIAL_PRODCUTION, NONFARM_PAYROLLS]].pct_change(12).dropna()
+    kkt_data[TEN_YEAR_TREASURY_YIELD_MINUS_FF] = kkt_data[TEN_YEAR_TREASURY_YIELD_MINUS_FF].ffill()
+    kkt_data[TEN_YEAR_TREASURY_YIELD_MINUS_FF] = kkt_data[TEN_YEAR_TREASURY_YIELD_MINUS_FF].rolling(
+        window=12).mean()
+    kkt_data.dropna(subset=[INDUSTRIAL_PRODCUTION, NONFARM_PAYROLLS, TEN_YEAR_TREASURY_YIELD_MINUS_FF], how='any',
+                    inplace=True)
+    sp500 = shiller_data['S&P'].copy()
+    sp500 = sp500.pct_change(12).dropna()
+    kkt_data = pd.merge(kkt_data, sp500, how='outer', left_index=True, right_index=True)
+    kkt_data.ffill(inplace=True)
+    kkt_data.dropna(how='any', inplace=True)
+    return kkt_data
+
+
+def cached_kkt_data(fred_data, shiller_data, store):
+    # the prepared KKT panel is persisted under the hash of its raw inputs, so a refresh with unchanged
+    # macro data loads it instead of preparing it again
+    raw = pd.concat([fred_data, shiller_data[SHILLER_COLUMNS]], axis=1)
+    return store.get_or_compute('kkt_data', raw, lambda: prepare_kkt_data(fred_data.copy(), shiller_data))
+
+
+def fetch_returns(tickers, start_date, end_date, dtype=RETURNS_DTYPE):
+    prices = get_yahoo_data(tickers, start_date=start_date, end_date=end_date)
+    return ReturnPanel.from_prices(prices, dtype=dtype)
+
+
+def risk_indicators(returns, window_size, denoise, quantile):
+    # Absorption ratio and turbulence from one streamed pass of rolling sample covariances: each block feeds
+    # both indicators and is then dropped, so memory stays at one block however large the universe
+    frame = as_frame(returns)
+    values = np.asarray(returns)
+    n_components = int(round(0.2 * frame.shape[1]))
+    denoiser = DenoisedCovariance() if denoise else None
+    seconds = {'covariances': 0., 'absorption_ratio': 0., 'turbulence': 0.}
+    n_covariances = 0
+    absorption_ratio_blocks, turbulence_blocks = [], []
+    blocks = SampleCovariance().rolling(frame, window_size)
+    while True:
+        start = time.perf_counter()
+        block = next(blocks, None)
+        seconds['covariances'] += time.perf_counter() - start
+        if block is None:
+            break
+        end, means, covs = block
+        n_covariances += len(covs)
+        start = time.perf_counter()
+        turbulence_blocks.append((end, turbulence_from_covariances(values, end, means, covs)))
+        seconds['turbulence'] += time.perf_counter() - start
+        start = time.perf_counter()
+        if denoiser is not None:
+            covs = next(denoiser.denoise([block], window_size / frame.shape[1]))[2]
+        absorption_ratio_blocks.append((end, absorption_ratio_from_covariances(covs, n_components)))
+        seconds['absorption_ratio'] += time.perf_counter() - start
+    absorption_ratio = rolling_frame(absorption_ratio_blocks, frame, 'Absorption_Ratio')
+    turbulence = rolling_frame(turbulence_blocks, frame, 'Turbulence')
+    for indicator, indicator_seconds in seconds.items():
+        METRICS.observe('indicator', indicator_seconds, indicator=indicator)
+    for indicator, windows in [('covariances', n_covariances), ('absorption_ratio', len(absorption_ratio)),
+                               ('turbulence', len(turbulence))]:
+        METRICS.count('windows_processed', windows, indicator=indicator)
+    return {'absorption_ratio': standardize_absorption_ratio(absorption_ratio),
+            'turbulence': filter_turbulence(turbulence, quantile)}
+
+
+def kkt_attribution(kkt_data, econ_vars, recession_var):
+    with METRICS.span('indicator', indicator='kkt'):
+        kkt = KKT_Attribution(kkt_data.copy(), econ_vars=econ_vars, recession_var=recession_var)
+    METRICS.count('windows_processed', len(kkt.df), indicator='kkt')
+    return {'probability': kkt.df['Probability1.0'], 'variable_importance': kkt.variable_importance}
+
+
+def cached_indicator(data, store, name, compute, **params):
+    # reuse a stored result when the inputs and parameters hash to a known key
+    return store.get_or_compute(name, data, lambda: compute(data, **params), **params)
+
+
+def build_pipeline(store, universes=UNIVERSES):
+    # fetch -> indicator nodes per universe, plus fred/shiller fetch -> KKT prep -> KKT attribution
+    nodes = []
+    risk_params = {'window_size': WINDOW_SIZE, 'denoise': DENOISE_ABSORPTION_RATIO, 'quantile': TURBULENCE_QUANTILE}
+    for universe, tickers in universes.items():
+        returns = universe + '_returns'
+        nodes += [Node(returns, fetch_returns, kind='fetch',
+                       kwargs={'tickers': tickers, 'start_date': START_DATE, 'end_date': END_DATE}),
+                  Node(universe + '_risk', cached_indicator, deps=[returns],
+                       kwargs=dict(store=store, name=universe + '_risk', compute=risk_indicators,
+                                   **risk_params))]
+    nodes += [Node('fred', get_fred_data, kind='fetch',
+                   kwargs={'macro_tickers': KKT_BUSINESS_CYCLE_INDICATOR_SERIES, 'start_date': None,
+                           'end_date': END_DATE}),
+              Node('shiller', get_shiller_data, kind='fetch',
+                   kwargs={'url': SHILLER_URL, 'sheet_name': SHILLER_SHEET_NAME, 'skiprows': SHILLER_SKIP_ROW}),
+              Node('kkt_data', cached_kkt_data, deps=['fred', 'shiller'], kind='transform', kwargs={'store': store}),
+              Node('kkt', cached_indicator, deps=['kkt_data'],
+                   kwargs=dict(store=store, name='kkt', compute=kkt_attribution, econ_vars=ECON_VARIABLES,
+                               recession_var=NBER_RECESSION))]
+    return nodes
+
+
+def prune_results(store, universes=UNIVERSES):
+    # drop stored results beyond RESULTS_KEEP per universe and per KKT step; run once in this process after
+    # publishing, never from the worker nodes that may still be reading them
+    for name in [universe + '_risk' for universe in universes] + ['kkt_data', 'kkt']:
+        store.prune(name)
+
+
+def compute_indicators(store, universes=UNIVERSES, max_workers=PIPELINE_MAX_WORKERS):
+    # Run the pipeline DAG (independent universes and indicators in parallel) and publish the dashboard series.
+    # Each run is logged as one structured METRICS record; a profiled run executes every node in this thread.
+    profiling = METRICS.take_profile_request()
+    with METRICS.refresh(), METRICS.profile(profiling):
+        executor = DagExecutor(build_pipeline(store, universes), max_workers=0 if profiling else max_workers,
+                               max_threads=0 if profiling else FETCH_MAX_WORKERS)
+        results = executor.run()
+        logger.info('pipeline node timings:\n%s', executor.timings.to_string())
+        dashboard = {}
+        for universe in universes:
+            dashboard[universe + '_absorption_ratio'] = results[universe + '_risk']['absorption_ratio']
+            dashboard[universe + '_turbulence'] = results[universe + '_risk']['turbulence']
+        dashboard['kkt_recession_probability'] = results['kkt']['probability']
+        dashboard['kkt_variable_importance'] = results['kkt']['variable_importance']
+        store.publish(dashboard)
+        prune_results(store, universes)
+    return dashboard
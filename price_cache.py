@@ -0,0 +1,204 @@
+import contextlib
+import datetime
+import json
+import os
+import threading
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+from constants import CACHE_DIR, CACHE_MAX_BYTES, CACHE_MAX_AGE
+from instrumentation import METRICS
+
+
+class PriceCache:
+    # On-disk cache of per-ticker series, keyed by (source, ticker).
+    # Each entry is a pair of .npy files (int64 dates, float64 values) that are memory-mapped on read,
+    # plus a row in index.json with the covered range, fetch/access times and size for staleness and eviction,
+    # and for file sources the version (validators, content hash) it was parsed from.
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.index = self.read_index()
+        # pipeline fetch nodes share one cache across threads; the lock guards the index, and a lock per entry
+        # makes each get_frame's check -> fetch -> store of a ticker atomic
+        self.lock = threading.RLock()
+        self.entry_locks = {}
+        self.reserved = set()
+
+    def read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def write_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with self.lock:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.index_path)
+
+    def key(self, source, ticker):
+        return quote(source, safe='') + '__' + quote(ticker, safe='')
+
+    def paths(self, key):
+        return os.path.join(self.cache_dir, key + '.dates.npy'), os.path.join(self.cache_dir, key + '.values.npy')
+
+    def load(self, source, ticker):
+        key = self.key(source, ticker)
+        if key not in self.index:
+            return None
+        dates_path, values_path = self.paths(key)
+        try:
+            dates = np.load(dates_path, mmap_mode='r')
+            values = np.load(values_path, mmap_mode='r')
+        except (OSError, ValueError):
+            self.remove(key)
+            return None
+        with self.lock:
+            self.index[key]['accessed_at'] = now_timestamp()
+        return pd.Series(values, index=pd.DatetimeIndex(dates.view('datetime64[ns]'), name='Date'), name=ticker)
+
+    def store(self, source, ticker, series, start_date=None, version=None):
+        series = pd.Series(series, dtype=np.float64).dropna()
+        series = series[~series.index.duplicated(keep='last')].sort_index()
+        key = self.key(source, ticker)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        dates = pd.DatetimeIndex(series.index).values.astype('datetime64[ns]').view(np.int64)
+        for path, array in zip(self.paths(key), (dates, series.values)):
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(path + '.tmp', path)
+        previous = self.index.get(key, {})
+        timestamp = now_timestamp()
+        entry = {'source': source,
+                 'ticker': ticker,
+                 'start_date': to_iso(start_date) if start_date is not None or not previous
+                               else previous.get('start_date'),
+                 'first_date': to_iso(series.index[0]) if len(series) else None,
+                 'last_date': to_iso(series.index[-1]) if len(series) else None,
+                 'fetched_at': timestamp,
+                 'accessed_at': timestamp,
+                 'nbytes': int(dates.nbytes + series.values.nbytes),
+                 'version': previous.get('version') if version is None else version}
+        with self.lock:
+            self.index[key] = entry
+
+    def version(self, source, ticker):
+        entry = self.index.get(self.key(source, ticker))
+        return None if entry is None else entry.get('version')
+
+    def touch(self, source, ticker, version=None):
+        # the source is unchanged since the entry was stored: mark it fresh without rewriting it
+        with self.lock:
+            entry = self.index[self.key(source, ticker)]
+            entry['fetched_at'] = now_timestamp()
+            if version is not None:
+                entry['version'] = version
+
+    def remove(self, key):
+        with self.lock:
+            for path in self.paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.index.pop(key, None)
+
+    def is_stale(self, source, ticker):
+        entry = self.index.get(self.key(source, ticker))
+        if entry is None:
+            return True
+        fetched_at = datetime.datetime.fromisoformat(entry['fetched_at'])
+        return datetime.datetime.now(datetime.timezone.utc) - fetched_at > self.max_age
+
+    def covers_start(self, source, ticker, start_date):
+        # an entry fetched from an earlier (or unbounded) start covers any later start
+        entry = self.index.get(self.key(source, ticker))
+        if entry is None or entry['last_date'] is None:
+            return False
+        if entry['start_date'] is None:
+            return True
+        return start_date is not None and pd.Timestamp(entry['start_date']) <= pd.Timestamp(start_date)
+
+    @contextlib.contextmanager
+    def reserve(self, source, tickers):
+        # Hold the entries of `tickers` for one read-through: other threads reading them wait, and evict()
+        # leaves them alone. Locks are taken in key order so overlapping calls cannot deadlock.
+        keys = sorted(set(self.key(source, ticker) for ticker in tickers))
+        with self.lock:
+            locks = [self.entry_locks.setdefault(key, threading.Lock()) for key in keys]
+        with contextlib.ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            with self.lock:
+                self.reserved.update(keys)
+            try:
+                yield
+            finally:
+                with self.lock:
+                    self.reserved.difference_update(keys)
+
+    def evict(self):
+        # drop least-recently-accessed entries until the cache fits in max_bytes; entries reserved by a
+        # read-through in progress (including the caller's) are kept
+        with self.lock:
+            total = sum(entry['nbytes'] for entry in self.index.values())
+            for key in sorted(self.index, key=lambda k: self.index[k]['accessed_at']):
+                if total <= self.max_bytes:
+                    break
+                if key in self.reserved:
+                    continue
+                total -= self.index[key]['nbytes']
+                self.remove(key)
+
+    def get_frame(self, source, tickers, fetch, start_date=None, end_date=None):
+        # Read-through: `fetch(tickers, start_date, end_date)` returns a frame with one column per ticker
+        # and is only called for tickers that are missing, or stale with bars missing before end_date.
+        # Concurrent calls sharing tickers run one after the other, so a ticker is fetched once.
+        with self.reserve(source, tickers):
+            full, top_up = [], []
+            for ticker in tickers:
+                if not self.covers_start(source, ticker, start_date):
+                    full.append(ticker)
+                    continue
+                last_date = pd.Timestamp(self.index[self.key(source, ticker)]['last_date'])
+                if self.is_stale(source, ticker) and (end_date is None or last_date < pd.Timestamp(end_date)):
+                    top_up.append(ticker)
+            METRICS.count('price_cache_misses', len(full), source=source)
+            METRICS.count('price_cache_top_ups', len(top_up), source=source)
+            METRICS.count('price_cache_hits', len(tickers) - len(full) - len(top_up), source=source)
+            if full:
+                fetched = fetch(full, start_date, end_date)
+                for ticker in full:
+                    self.store(source, ticker, fetched[ticker], start_date=start_date)
+            if top_up:
+                since = min(pd.Timestamp(self.index[self.key(source, t)]['last_date']) for t in top_up)
+                fetched = fetch(top_up, (since + pd.Timedelta(days=1)).date(), end_date)
+                for ticker in top_up:
+                    cached = self.load(source, ticker)
+                    new = fetched[ticker].dropna() if ticker in fetched else cached.iloc[:0]
+                    new = new[new.index > cached.index[-1]]
+                    self.store(source, ticker, pd.concat([cached, new]))
+            series = []
+            for ticker in tickers:
+                ticker_data = self.load(source, ticker)
+                series.append(ticker_data.loc[to_timestamp(start_date):to_timestamp(end_date)])
+            if full or top_up:
+                self.evict()
+            self.write_index()
+            return pd.concat(series, axis=1)
+
+
+def now_timestamp():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def to_timestamp(date):
+    return None if date is None else pd.Timestamp(date)
+
+
+def to_iso(date):
+    return None if date is None else pd.Timestamp(date).isoformat()
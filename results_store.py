@@ -0,0 +1,175 @@
+import datetime
+import hashlib
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from zoneinfo import ZoneInfo
+import pandas as pd
+from constants import RESULTS_DIR, RESULTS_KEEP, REFRESH_TIME, REFRESH_TIMEZONE
+from return_panel import as_frame
+from instrumentation import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+def hash_inputs(data, **params):
+    # Content hash of a frame/series/return panel plus the parameters it is computed with
+    data = as_frame(data)
+    digest = hashlib.sha1()
+    digest.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+    digest.update(repr(list(getattr(data, 'columns', [getattr(data, 'name', None)]))).encode())
+    digest.update(repr(sorted(params.items())).encode())
+    return digest.hexdigest()
+
+
+class ResultsStore:
+    # Computed indicator series keyed by input-data hash and parameters, kept in memory and pickled to
+    # store_dir, plus the latest published set of dashboard results with its computation time.
+    # Readers in other processes pick up a new publication through the mtime of latest.pkl.
+
+    def __init__(self, store_dir=RESULTS_DIR):
+        self.store_dir = store_dir
+        self.latest_path = os.path.join(store_dir, 'latest.pkl')
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.results = None
+        self.computed_at = None
+        self.latest_mtime = None
+
+    def __getstate__(self):
+        # pickled into pipeline worker processes: they share the on-disk store, not the in-memory state
+        return {'store_dir': self.store_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['store_dir'])
+
+    def path(self, key):
+        return os.path.join(self.store_dir, key + '.pkl')
+
+    def write(self, path, value):
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def get(self, key):
+        if key not in self.cache:
+            # another process may prune the file at any time; a missing file is a miss
+            try:
+                with open(self.path(key), 'rb') as f:
+                    self.cache[key] = pickle.load(f)
+            except FileNotFoundError:
+                pass
+        return self.cache.get(key)
+
+    def put(self, key, value):
+        self.cache[key] = value
+        self.write(self.path(key), value)
+
+    def touch(self, key):
+        # mark a stored result as just used, so prune() keeps it
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, name, keep=RESULTS_KEEP):
+        # keep only the `keep` most recently used results of `name` (keys are name + '_' + sha1 hex).
+        # Files that vanish meanwhile (pruned by another process) are skipped.
+        pattern = re.compile(re.escape(name) + r'_[0-9a-f]{40}\.pkl$')
+        if not os.path.isdir(self.store_dir):
+            return
+        mtimes = {}
+        for file in os.listdir(self.store_dir):
+            if pattern.match(file):
+                try:
+                    mtimes[file] = os.path.getmtime(os.path.join(self.store_dir, file))
+                except FileNotFoundError:
+                    pass
+        for file in sorted(mtimes, key=mtimes.get)[:-keep or None]:
+            try:
+                os.remove(os.path.join(self.store_dir, file))
+            except FileNotFoundError:
+                pass
+            self.cache.pop(file[:-len('.pkl')], None)
+
+    def get_or_compute(self, name, data, compute, **params):
+        # pruning is left to the caller (compute_indicators prunes once per refresh, after publishing)
+        key = name + '_' + hash_inputs(data, **params)
+        value = self.get(key)
+        METRICS.count('results_cache_misses' if value is None else 'results_cache_hits', indicator=name)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        else:
+            self.touch(key)
+        return value
+
+    def publish(self, results):
+        computed_at = datetime.datetime.now(datetime.timezone.utc)
+        self.write(self.latest_path, {'results': results, 'computed_at': computed_at})
+        with self.lock:
+            self.results, self.computed_at = results, computed_at
+            self.latest_mtime = os.path.getmtime(self.latest_path)
+
+    def latest(self):
+        # (results, computed_at) of the most recent publication, or (None, None) before the first one
+        with self.lock:
+            if os.path.exists(self.latest_path) and os.path.getmtime(self.latest_path) != self.latest_mtime:
+                self.latest_mtime = os.path.getmtime(self.latest_path)
+                with open(self.latest_path, 'rb') as f:
+                    latest = pickle.load(f)
+                self.results, self.computed_at = latest['results'], latest['computed_at']
+            return self.results, self.computed_at
+
+
+class RefreshScheduler(threading.Thread):
+    # Daemon thread that runs `refresh` once at start-up and then after every weekday market close
+
+    def __init__(self, refresh, run_at=REFRESH_TIME, timezone=REFRESH_TIMEZONE, run_on_start=True):
+        super().__init__(daemon=True, name='results-refresh')
+        self.refresh = refresh
+        self.run_at = run_at
+        self.timezone = ZoneInfo(timezone)
+        self.run_on_start = run_on_start
+        self.stopped = threading.Event()
+        self.triggered = threading.Event()
+
+    def next_run(self, now=None):
+        now = now or datetime.datetime.now(self.timezone)
+        run = datetime.datetime.combine(now.date(), self.run_at, tzinfo=self.timezone)
+        if run <= now:
+            run += datetime.timedelta(days=1)
+        while run.weekday() >= 5:
+            run += datetime.timedelta(days=1)
+        return run
+
+    def run_refresh(self):
+        start = time.perf_counter()
+        try:
+            self.refresh()
+            logger.info('results refreshed in %.1fs', time.perf_counter() - start)
+        except Exception:
+            logger.exception('results refresh failed')
+
+    def run(self):
+        if self.run_on_start:
+            self.run_refresh()
+        while not self.stopped.is_set():
+            delay = (self.next_run() - datetime.datetime.now(self.timezone)).total_seconds()
+            self.triggered.wait(max(delay, 0.))
+            self.triggered.clear()
+            if self.stopped.is_set():
+                break
+            self.run_refresh()
+
+    def trigger(self):
+        # run a refresh now instead of waiting for the next close
+        self.triggered.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.triggered.set()
@@ -0,0 +1,86 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+class ReturnPanel:
+    # Returns of a universe as one C-contiguous float64 (or float32) array with its dates and tickers.
+    # Indicators read it through to_frame(), a DataFrame view on the same memory; save() writes .npy files
+    # that load() memory-maps, so a large panel is paged in from disk rather than held per worker.
+
+    def __init__(self, values, index, columns):
+        self.values = np.ascontiguousarray(values)
+        self.index = pd.DatetimeIndex(index)
+        self.columns = pd.Index(columns)
+        if self.values.shape != (len(self.index), len(self.columns)):
+            raise ValueError('values of shape %s do not match %d dates x %d tickers'
+                             % (self.values.shape, len(self.index), len(self.columns)))
+
+    @classmethod
+    def from_frame(cls, frame, dtype=np.float64):
+        return cls(frame.to_numpy(dtype=dtype), frame.index, frame.columns)
+
+    @classmethod
+    def from_prices(cls, prices, dtype=np.float64, chunk_size=4096):
+        # prices.pct_change().dropna() written straight into a `dtype` array, computed in float64 by row blocks
+        # so float32 panels never hold a float64 copy
+        levels = prices.to_numpy(dtype=np.float64, copy=False)
+        values = np.empty((max(len(levels) - 1, 0), levels.shape[1]), dtype=dtype)
+        for first in range(0, len(values), chunk_size):
+            block = levels[first:first + chunk_size + 1]
+            values[first:first + chunk_size] = block[1:] / block[:-1] - 1.
+        complete = ~np.isnan(values).any(axis=1)
+        if not complete.all():
+            values = values[complete]
+        return cls(values, prices.index[1:][complete], prices.columns)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __array__(self, dtype=None, copy=None):
+        # np.asarray(panel) is the values themselves unless another dtype is asked for
+        if dtype is None or np.dtype(dtype) == self.values.dtype:
+            return self.values.copy() if copy else self.values
+        return self.values.astype(dtype)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def to_frame(self):
+        return pd.DataFrame(self.values, index=self.index, columns=self.columns, copy=False)
+
+    def paths(self, path):
+        return path + '.dates.npy', path + '.values.npy', path + '.columns.json'
+
+    def save(self, path):
+        dates_path, values_path, columns_path = self.paths(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.save(dates_path, self.index.values.astype('datetime64[ns]').view(np.int64))
+        np.save(values_path, self.values)
+        with open(columns_path, 'w') as f:
+            json.dump(list(self.columns), f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        panel = cls.__new__(cls)
+        dates_path, values_path, columns_path = panel.paths(path)
+        panel.values = np.load(values_path, mmap_mode=mmap_mode)
+        panel.index = pd.DatetimeIndex(np.load(dates_path).view('datetime64[ns]'))
+        with open(columns_path) as f:
+            panel.columns = pd.Index(json.load(f))
+        return panel
+
+
+def as_frame(returns):
+    # indicators take a ReturnPanel or a DataFrame; either way they work on a frame over the same memory
+    return returns.to_frame() if isinstance(returns, ReturnPanel) else returns
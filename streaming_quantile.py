@@ -0,0 +1,146 @@
+import heapq
+import math
+import numpy as np
+
+
+def interpolated_quantile(sorted_values, quantile):
+    # linear interpolation between order statistics, as pandas' rolling/expanding quantile
+    position = quantile * (len(sorted_values) - 1)
+    lower = int(position)
+    if lower == position:
+        return sorted_values[lower]
+    return sorted_values[lower] + (sorted_values[lower + 1] - sorted_values[lower]) * (position - lower)
+
+
+class ExpandingQuantile:
+    # Exact expanding quantile in O(log n) per observation with two heaps: `low` (a max-heap, stored negated)
+    # holds the floor(q * (n - 1)) + 1 smallest values and `high` the rest, so the two order statistics that
+    # pandas interpolates between are always the heap tops.
+
+    def __init__(self, quantile, values=()):
+        self.quantile = quantile
+        values = sorted(values)
+        split = self.low_size(len(values))
+        self.low = [-value for value in reversed(values[:split])]
+        self.high = values[split:]
+
+    def __len__(self):
+        return len(self.low) + len(self.high)
+
+    def values(self):
+        # the observations so far, unordered
+        return [-value for value in self.low] + self.high
+
+    def low_size(self, count):
+        return int(self.quantile * (count - 1)) + 1 if count else 0
+
+    def add(self, value):
+        if self.low and value <= -self.low[0]:
+            heapq.heappush(self.low, -value)
+        else:
+            heapq.heappush(self.high, value)
+        target = self.low_size(len(self))
+        while len(self.low) > target:
+            heapq.heappush(self.high, -heapq.heappop(self.low))
+        while len(self.low) < target:
+            heapq.heappush(self.low, -heapq.heappop(self.high))
+        return self.value()
+
+    def value(self):
+        count = len(self)
+        if not count:
+            return math.nan
+        position = self.quantile * (count - 1)
+        lower = -self.low[0]
+        if int(position) == position:
+            return lower
+        return lower + (self.high[0] - lower) * (position - int(position))
+
+
+class P2Quantile:
+    # Approximate expanding quantile in O(1) time and memory: the P-square algorithm (Jain & Chlamtac, 1985)
+    # tracks five markers whose heights follow the minimum, q/2, q, (1 + q)/2 quantiles and the maximum.
+    # Against the exact expanding 0.9 quantile of chi-square values (benchmark_expanding_quantile) the mean
+    # relative error falls from about 1% at 1,000 observations to 0.04% at 100,000, but single thresholds are
+    # off by much more while the history is short. Over 60 seeded series of 20,000 the largest relative error
+    # was 16% from the 100th observation on, 6.5% from the 1,000th and 1% from the 10,000th; take the bound as
+    # 20%, 7% and 1.5% from those points.
+
+    def __init__(self, quantile, values=()):
+        self.quantile = quantile
+        self.count = 0
+        self.heights = []
+        self.positions = [0., 1., 2., 3., 4.]
+        self.desired = [0., 2 * quantile, 4 * quantile, 2 + 2 * quantile, 4.]
+        self.increments = [0., quantile / 2, quantile, (1 + quantile) / 2, 1.]
+        for value in values:
+            self.add(value)
+
+    @classmethod
+    def from_values(cls, quantile, values):
+        # Sketch of an existing history with its markers placed exactly: each at the order statistic nearest its
+        # desired position, so the estimate starts at the exact quantile (to the nearest observation) instead of
+        # the error of replaying the history through add()
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) <= 5:
+            return cls(quantile, values)
+        sketch = cls(quantile)
+        sketch.count = len(values)
+        sketch.desired = [(len(values) - 1) * increment for increment in sketch.increments]
+        positions = [int(round(desired)) for desired in sketch.desired]
+        # markers need distinct positions, which rounding can merge for extreme quantiles
+        for i in range(1, 4):
+            positions[i] = min(max(positions[i], positions[i - 1] + 1), len(values) - 5 + i)
+        sketch.positions = [float(position) for position in positions]
+        sketch.heights = list(np.partition(values, positions)[positions])
+        return sketch
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value):
+        self.count += 1
+        if self.count <= 5:
+            self.heights.append(value)
+            self.heights.sort()
+            return self.value()
+        heights, positions = self.heights, self.positions
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = next(i for i in range(4) if value < heights[i + 1])
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in range(1, 4):
+            drift = self.desired[i] - positions[i]
+            if (drift >= 1 and positions[i + 1] - positions[i] > 1) or \
+                    (drift <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if drift > 0 else -1
+                height = self.parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (positions[i + step] - positions[i])
+                heights[i] = height
+                positions[i] += step
+        return self.value()
+
+    def parabolic(self, i, step):
+        heights, positions = self.heights, self.positions
+        return heights[i] + step / (positions[i + 1] - positions[i - 1]) * (
+            (positions[i] - positions[i - 1] + step) * (heights[i + 1] - heights[i]) / (positions[i + 1] - positions[i])
+            + (positions[i + 1] - positions[i] - step) * (heights[i] - heights[i - 1]) / (positions[i] - positions[i - 1]))
+
+    def value(self):
+        if not self.count:
+            return math.nan
+        if self.count <= 5:
+            return interpolated_quantile(self.heights, self.quantile)
+        return self.heights[2]
+
+
+QUANTILE_ESTIMATORS = {'exact': ExpandingQuantile, 'p2': P2Quantile}
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+from absorptionratio import (AbsorptionRatio, TruncatedEigensolver, truncated_absorption_ratio,
+                             rolling_absorption_ratio)
+
+
+def one_factor_returns(n_obs=900, n_assets=8, seed=0):
+    rng = np.random.default_rng(seed)
+    factor = rng.normal(0., 0.01, size=(n_obs, 1))
+    returns = factor * rng.uniform(0.5, 1.5, size=(1, n_assets)) + rng.normal(0., 0.01, size=(n_obs, n_assets))
+    return pd.DataFrame(returns, index=pd.bdate_range('2000-01-03', periods=n_obs),
+                        columns=['A%d' % i for i in range(n_assets)])
+
+
+@pytest.mark.parametrize('denoise', [False, True])
+def test_update_equals_recompute(denoise):
+    # the last 100 rows applied in 7-row update() steps give the same series as one full computation
+    returns = one_factor_returns()
+    full = AbsorptionRatio(returns, window_size=252, denoise=denoise)
+    incremental = AbsorptionRatio(returns.iloc[:-100], window_size=252, denoise=denoise)
+    for start in range(len(returns) - 100, len(returns), 7):
+        incremental.update(returns.iloc[:start + 7])
+    pd.testing.assert_frame_equal(incremental.absorption_ratio_raw, full.absorption_ratio_raw, rtol=1e-10)
+    pd.testing.assert_frame_equal(incremental.absorption_ratio_standardized, full.absorption_ratio_standardized,
+                                  rtol=1e-8)
+
+
+@pytest.mark.parametrize('n_obs, n_assets, window_size', [(140, 60, 40), (200, 40, 120)])
+def test_truncated_solver_matches_dense(n_obs, n_assets, window_size):
+    # window_size <= N takes the exact reduced window x window path, window_size > N subspace iteration
+    returns = one_factor_returns(n_obs=n_obs, n_assets=n_assets)
+    solver = TruncatedEigensolver(int(round(0.2 * n_assets)), tol=1e-12)
+    truncated = truncated_absorption_ratio(returns, window_size, solver=solver)
+    assert (solver.iterations == 0) == (window_size <= n_assets)
+    pd.testing.assert_series_equal(truncated, rolling_absorption_ratio(returns, window_size), rtol=1e-9,
+                                   check_freq=False)
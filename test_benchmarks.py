@@ -0,0 +1,18 @@
+import json
+from benchmarks import BENCHMARK_GOLDEN, check_golden
+
+
+def test_indicators_reproduce_the_golden_outputs():
+    assert check_golden() == []
+
+
+def test_check_golden_reports_a_changed_output(tmp_path):
+    with open(BENCHMARK_GOLDEN) as f:
+        golden = json.load(f)
+    name = sorted(golden['outputs'])[0]
+    golden['outputs'][name]['samples'][-1] += 1e-3
+    path = str(tmp_path / 'golden.json')
+    with open(path, 'w') as f:
+        json.dump(golden, f)
+    mismatches = check_golden(path)
+    assert len(mismatches) == 1 and mismatches[0].startswith(name + ': samples')
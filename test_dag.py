@@ -0,0 +1,30 @@
+import threading
+import numpy as np
+import pandas as pd
+from dag import Node, DagExecutor
+
+# stands in for METRICS.lock and the like: held by another thread of the dashboard process
+HELD_LOCK = threading.Lock()
+
+
+def make_frame(n_obs):
+    return pd.DataFrame(np.arange(n_obs * 2.).reshape(n_obs, 2), index=pd.bdate_range('2020-01-01', periods=n_obs),
+                        columns=['A', 'B'])
+
+
+def column_sums(frame):
+    with HELD_LOCK:
+        return frame.sum()
+
+
+def test_process_nodes_do_not_inherit_held_locks():
+    nodes = [Node('frame', make_frame, kind='transform', kwargs={'n_obs': 10}),
+             Node('sums', column_sums, deps=['frame'])]
+    executor = DagExecutor(nodes, max_workers=1, max_threads=1)
+    results = {}
+    runner = threading.Thread(target=lambda: results.update(executor.run()), daemon=True)
+    with HELD_LOCK:
+        runner.start()
+        runner.join(timeout=30)
+    assert not runner.is_alive()
+    pd.testing.assert_series_equal(results['sums'], make_frame(10).sum())
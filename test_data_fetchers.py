@@ -0,0 +1,131 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from data_fetchers import fetch_concurrently, fetch_yahoo_data, align_prices
+
+
+class StubLoader:
+    # Stand-in for openbb: deterministic prices after `latency` seconds; the attempts listed in `failures`
+    # (1-based, per ticker) raise, those in `stalls` take `stall` seconds instead
+
+    def __init__(self, latency=0., failures=(), stalls=(), stall=1.):
+        self.latency = latency
+        self.failures = set(failures)
+        self.stalls = set(stalls)
+        self.stall = stall
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, ticker, start_date=None, end_date=None):
+        with self.lock:
+            attempt = self.attempts[ticker] = self.attempts.get(ticker, 0) + 1
+        time.sleep(self.stall if attempt in self.stalls else self.latency)
+        if attempt in self.failures:
+            raise ConnectionError('stub failure for %s' % ticker)
+        index = pd.bdate_range('2020-01-01', periods=5)
+        return pd.Series(np.arange(5.) + sum(map(ord, ticker)), index=index, name=ticker)
+
+
+def test_fetch_concurrently_keeps_ticker_order():
+    loader = StubLoader(latency=0.01)
+    tickers = ['T%02d' % i for i in range(12)]
+    results = fetch_concurrently(loader, tickers, max_workers=4)
+    assert [series.name for series in results] == tickers
+
+
+def test_failed_attempts_are_retried():
+    loader = StubLoader(failures=[1, 2])
+    results = fetch_concurrently(loader, ['A', 'B'], retries=3, backoff=0.)
+    assert [series.name for series in results] == ['A', 'B']
+    assert loader.attempts == {'A': 3, 'B': 3}
+
+
+def test_retries_are_bounded():
+    loader = StubLoader(failures=[1, 2, 3])
+    with pytest.raises(RuntimeError, match='after 3 attempts'):
+        fetch_concurrently(loader, ['A'], retries=3, backoff=0.)
+
+
+def test_timed_out_attempt_is_retried():
+    loader = StubLoader(stalls=[1], stall=1.)
+    start = time.monotonic()
+    results = fetch_concurrently(loader, ['A'], max_workers=2, timeout=0.2, backoff=0.)
+    assert results[0].name == 'A'
+    assert loader.attempts['A'] == 2
+    assert time.monotonic() - start < 1.
+
+
+def test_attempts_that_always_time_out_fail():
+    loader = StubLoader(stalls=[1, 2], stall=1.)
+    with pytest.raises(RuntimeError, match='after 2 attempts'):
+        fetch_concurrently(loader, ['A'], max_workers=2, retries=2, timeout=0.1, backoff=0.)
+
+
+def test_fetch_yahoo_data_joins_on_dates():
+    prices = fetch_yahoo_data(['A', 'B'], None, None, load=StubLoader())
+    assert list(prices.columns) == ['A', 'B']
+    assert len(prices) == 5
+
+
+@pytest.fixture
+def staggered_prices():
+    # A from the first date, B from the third, C from the fifth; A has a gap on the fourth
+    index = pd.date_range('2020-01-01', periods=6)
+    return pd.DataFrame({'A': [1., 2., 3., np.nan, 5., 6.],
+                         'B': [np.nan, np.nan, 3., 4., 5., 6.],
+                         'C': [np.nan] * 4 + [5., 6.]}, index=index)
+
+
+def test_inner_alignment_keeps_common_dates(staggered_prices):
+    aligned = align_prices(staggered_prices, 'inner')
+    assert list(aligned.index) == list(staggered_prices.index[4:])
+    assert not aligned.isna().any().any()
+
+
+def test_ffill_alignment_fills_gaps_but_not_history(staggered_prices):
+    aligned = align_prices(staggered_prices, 'ffill')
+    assert aligned.loc['2020-01-04', 'A'] == 3.
+    assert aligned['B'].isna().sum() == 2
+    assert aligned['C'].isna().sum() == 4
+
+
+def test_min_start_alignment_drops_late_tickers(staggered_prices):
+    aligned = align_prices(staggered_prices, 'min_start', min_start_dates='2020-01-03')
+    assert list(aligned.columns) == ['A', 'B']
+    assert aligned.index[0] == pd.Timestamp('2020-01-03')
+    assert not aligned.isna().any().any()
+
+
+def test_min_start_alignment_by_ticker(staggered_prices):
+    aligned = align_prices(staggered_prices, 'min_start',
+                           min_start_dates={'A': '2020-01-01', 'B': '2020-01-02', 'C': None})
+    assert list(aligned.columns) == ['A', 'C']
+    assert aligned.index[0] == pd.Timestamp('2020-01-05')
+
+
+def test_unknown_alignment_raises(staggered_prices):
+    with pytest.raises(ValueError):
+        align_prices(staggered_prices, 'outer')
+
+
+def test_queued_attempts_do_not_time_out():
+    # 20 tickers on 2 workers take about 1s in all, but no single fetch comes near the timeout
+    loader = StubLoader(latency=0.1)
+    tickers = ['T%02d' % i for i in range(20)]
+    results = fetch_concurrently(loader, tickers, max_workers=2, retries=1, timeout=0.35)
+    assert [series.name for series in results] == tickers
+    assert set(loader.attempts.values()) == {1}
+
+
+def test_abandoned_attempts_do_not_hold_worker_slots():
+    # every first attempt stalls, so the abandoned threads outnumber the workers twice over; the retries still
+    # start at once rather than queueing behind them
+    loader = StubLoader(stalls=[1], stall=2.)
+    tickers = ['T%d' % i for i in range(4)]
+    start = time.monotonic()
+    results = fetch_concurrently(loader, tickers, max_workers=2, retries=2, timeout=0.2, backoff=0.)
+    assert [series.name for series in results] == tickers
+    assert loader.attempts == {ticker: 2 for ticker in tickers}
+    assert time.monotonic() - start < 1.
@@ -0,0 +1,36 @@
+import numpy as np
+from instrumentation import Metrics, current_rss_bytes, peak_rss_bytes
+
+
+def test_span_memory_is_attributed_to_the_allocating_span():
+    metrics = Metrics()
+    with metrics.span('allocate'):
+        kept = np.ones(64 * 2 ** 20 // 8)
+    with metrics.span('idle'):
+        pass
+    spans = {name: span for (name, _), span in metrics.export()['spans'].items()}
+    assert spans['allocate']['max_rss_growth_bytes'] >= 0.9 * kept.nbytes
+    assert spans['idle']['max_rss_growth_bytes'] < 0.1 * kept.nbytes
+    assert spans['idle']['max_peak_rss_growth_bytes'] < 0.1 * kept.nbytes
+
+
+def test_transient_allocations_show_as_peak_growth():
+    # freed before the span ends, so only visible as a raised process peak
+    metrics = Metrics()
+    above_peak = 64 * 2 ** 20
+    size = max(peak_rss_bytes() - current_rss_bytes(), 0) + above_peak
+    with metrics.span('transient'):
+        np.ones(size // 8).sum()
+    span = metrics.export()['spans'][('transient', ())]
+    assert span['max_peak_rss_growth_bytes'] >= 0.9 * above_peak
+    assert span['max_rss_growth_bytes'] < 0.5 * above_peak
+
+
+def test_merged_spans_keep_the_largest_growth():
+    parent, worker = Metrics(), Metrics()
+    parent.observe('node', 1., rss_growth=10, node='a')
+    worker.observe('node', 2., rss_growth=30, peak_rss_growth=40, node='a')
+    parent.merge(worker.export())
+    span = parent.export()['spans'][('node', (('node', 'a'),))]
+    assert (span['count'], span['max_rss_growth_bytes'], span['max_peak_rss_growth_bytes']) == (2, 30, 40)
+    assert 'riskmonitor_span_max_rss_growth_bytes{span="node",node="a"} 30' in parent.prometheus_text()
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.spatial import distance
+from kkt_attribution import KKT_Attribution
+
+ECON_VARS = ['INDPRO', 'PAYEMS', 'T10YFF', 'S&P']
+
+
+def macro_panel(near_singular, n_obs=240, seed=0):
+    # monthly panel with a two-state recession regime shifting the means; near_singular makes S&P an almost
+    # exact linear function of INDPRO within recessions
+    rng = np.random.default_rng(seed)
+    recession = (np.arange(n_obs) % 40 >= 30).astype(float)
+    values = rng.normal([0.02, 0.015, 1.5, 0.06], [0.02, 0.01, 1., 0.15], size=(n_obs, 4))
+    values += recession[:, None] * np.array([-0.04, -0.02, -1., -0.15])
+    if near_singular:
+        in_recession = recession == 1.
+        values[in_recession, 3] = 3. * values[in_recession, 0] + rng.normal(0., 1e-5, size=in_recession.sum())
+    panel = pd.DataFrame(values, index=pd.date_range('1960-01-01', periods=n_obs, freq='MS'), columns=ECON_VARS)
+    panel['USRECD'] = recession
+    return panel
+
+
+def rowwise_kkt(panel):
+    # the original row-by-row formulas: scipy mahalanobis given the covariance, likelihoods normalised directly
+    means = panel.groupby('USRECD')[ECON_VARS].mean()
+    covs = panel.groupby('USRECD')[ECON_VARS].cov()
+    regimes = means.index.values.tolist()
+    x = panel[ECON_VARS].values
+    likelihood, partial_derivs = {}, {}
+    for r in regimes:
+        cov, mean = covs.loc[r].values, means.loc[r].values
+        dist = np.array([distance.mahalanobis(row, mean, cov) for row in x])
+        likelihood[r] = np.linalg.det(2 * np.pi * cov) ** -0.5 * np.exp(-dist / 2)
+        partial_derivs[r] = np.array([np.linalg.inv(cov).dot(row - mean) for row in x])
+    total = sum(likelihood.values())
+    probability = {r: (likelihood[r] / total)[:, None] for r in regimes}
+    sensitivity = sum((1 / len(regimes)) * abs(probability[r] * sum(probability[z] * partial_derivs[z]
+                                                                    for z in regimes if z != r)
+                                               - (1 - probability[r] * partial_derivs[r])) for r in regimes)
+    weighted = sensitivity * panel[ECON_VARS].std().values
+    importance = weighted / abs(weighted).sum(axis=1, keepdims=True)
+    return probability[1.][:, 0], partial_derivs, importance
+
+
+@pytest.mark.parametrize('near_singular', [False, True])
+def test_vectorized_kkt_matches_rowwise_formulas(near_singular):
+    panel = macro_panel(near_singular)
+    kkt = KKT_Attribution(panel.copy(), econ_vars=ECON_VARS, recession_var='USRECD')
+    probability, partial_derivs, importance = rowwise_kkt(panel)
+    if near_singular:
+        assert np.linalg.cond(panel.loc[panel['USRECD'] == 1., ECON_VARS].cov().values) > 1e8
+    rtol = 1e-6 if near_singular else 1e-10
+    np.testing.assert_allclose(kkt.df['Probability1.0'].values, probability, rtol=rtol, atol=1e-12)
+    for r in [0., 1.]:
+        np.testing.assert_allclose(kkt.partial_derivs[r].values, partial_derivs[r], rtol=rtol)
+    np.testing.assert_allclose(kkt.variable_importance.values, importance, rtol=rtol)
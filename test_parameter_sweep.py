@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+from absorptionratio import AbsorptionRatio
+from turbulence import Turbulence
+from parameter_sweep import sweep
+
+
+def one_factor_returns(n_obs=700, n_assets=6, seed=0):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0., 0.01, size=(n_obs, n_assets)) + rng.normal(0., 0.01, size=(n_obs, 1))
+    return pd.DataFrame(returns, index=pd.bdate_range('2000-01-03', periods=n_obs),
+                        columns=['A%d' % i for i in range(n_assets)])
+
+
+def test_sweep_matches_one_run_per_setting():
+    returns = one_factor_returns()
+    cube = sweep(returns, windows=[63, 126], quantiles=[0.9, 0.95], max_workers=0)
+    assert cube.index.names == ['window', 'quantile', 'date']
+    for window_size in [63, 126]:
+        absorption_ratio = AbsorptionRatio(returns, window_size)
+        for quantile in [0.9, 0.95]:
+            setting = cube.loc[(window_size, quantile)]
+            turbulence = Turbulence(returns, window_size, quantile=quantile)
+            np.testing.assert_allclose(setting['absorption_ratio'].dropna(),
+                                       absorption_ratio.absorption_ratio_standardized['Absorption_Ratio'],
+                                       rtol=1e-8)
+            np.testing.assert_allclose(setting['filtered_turbulence'], turbulence.filtered_turbulence['Turbulence'],
+                                       rtol=1e-8)
+
+
+def test_process_pool_sweep_matches_inline_sweep():
+    returns = one_factor_returns()
+    inline = sweep(returns, windows=[63, 126, 252], quantiles=[0.9], max_workers=0)
+    pooled = sweep(returns, windows=[63, 126, 252], quantiles=[0.9], max_workers=2)
+    pd.testing.assert_frame_equal(inline, pooled)
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+from absorptionratio import AbsorptionRatio
+from turbulence import Turbulence
+from pipeline import risk_indicators
+from return_panel import ReturnPanel
+from instrumentation import METRICS
+
+
+@pytest.mark.parametrize('denoise', [False, True])
+def test_streamed_risk_indicators_match_the_indicator_classes(denoise):
+    rng = np.random.default_rng(0)
+    returns = pd.DataFrame(rng.normal(0., 0.01, size=(700, 6)) + rng.normal(0., 0.01, size=(700, 1)),
+                           index=pd.bdate_range('2000-01-03', periods=700), columns=list('ABCDEF'))
+    risk = risk_indicators(ReturnPanel.from_frame(returns), window_size=252, denoise=denoise, quantile=0.9)
+    absorption_ratio = AbsorptionRatio(returns, window_size=252, denoise=denoise)
+    turbulence = Turbulence(returns, window_size=252, quantile=0.9, estimator=None)
+    pd.testing.assert_series_equal(risk['absorption_ratio'],
+                                   absorption_ratio.absorption_ratio_standardized['Absorption_Ratio'], rtol=1e-10)
+    pd.testing.assert_series_equal(risk['turbulence'], turbulence.filtered_turbulence['Turbulence'],
+                                   rtol=1e-8, check_freq=False)
+
+
+def test_windows_are_counted_per_indicator():
+    rng = np.random.default_rng(0)
+    returns = pd.DataFrame(rng.normal(0., 0.01, size=(400, 4)), index=pd.bdate_range('2000-01-03', periods=400),
+                           columns=list('ABCD'))
+    METRICS.reset()
+    risk_indicators(returns, window_size=100, denoise=False, quantile=0.9)
+    counters = METRICS.export()['counters']
+    for indicator in ['covariances', 'absorption_ratio', 'turbulence']:
+        assert counters[('windows_processed', (('indicator', indicator),))] == 301
@@ -0,0 +1,70 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+from price_cache import PriceCache
+
+DATES = pd.bdate_range('2020-01-01', '2020-03-31')
+
+
+class StubFetch:
+    # Stand-in for a price source: a fixed price history per ticker, cut to the requested dates,
+    # recording every call after `latency` seconds
+
+    def __init__(self, latency=0.):
+        self.latency = latency
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, tickers, start_date, end_date):
+        with self.lock:
+            self.calls.append((list(tickers), start_date, end_date))
+        time.sleep(self.latency)
+        prices = pd.DataFrame({ticker: np.arange(len(DATES)) + sum(map(ord, ticker)) for ticker in tickers},
+                              index=DATES, dtype=np.float64)
+        return prices.loc[pd.Timestamp(start_date) if start_date else None:pd.Timestamp(end_date)]
+
+
+def test_warm_read_does_not_fetch(tmp_path):
+    fetch = StubFetch()
+    cold = PriceCache(str(tmp_path)).get_frame('stub', ['A', 'B'], fetch, '2020-01-01', '2020-03-31')
+    warm = PriceCache(str(tmp_path)).get_frame('stub', ['A', 'B'], fetch, '2020-02-01', '2020-03-31')
+    assert len(fetch.calls) == 1
+    pd.testing.assert_frame_equal(warm, cold.loc['2020-02-01':], check_freq=False)
+
+
+def test_stale_entries_are_topped_up(tmp_path):
+    fetch = StubFetch()
+    cache = PriceCache(str(tmp_path), max_age=pd.Timedelta(0))
+    cache.get_frame('stub', ['A', 'B'], fetch, '2020-01-01', '2020-02-28')
+    prices = cache.get_frame('stub', ['A', 'B'], fetch, '2020-01-01', '2020-03-31')
+    assert fetch.calls[1][0] == ['A', 'B']
+    assert pd.Timestamp(fetch.calls[1][1]) == pd.Timestamp('2020-02-29')
+    expected = fetch(['A', 'B'], '2020-01-01', '2020-03-31')
+    np.testing.assert_array_equal(prices.values, expected.values)
+    assert list(prices.index) == list(expected.index)
+
+
+def test_eviction_keeps_the_entries_just_fetched(tmp_path):
+    fetch = StubFetch()
+    cache = PriceCache(str(tmp_path), max_bytes=1)
+    cache.get_frame('stub', ['A'], fetch, '2020-01-01', '2020-03-31')
+    cache.get_frame('stub', ['B', 'C'], fetch, '2020-01-01', '2020-03-31')
+    assert sorted(entry['ticker'] for entry in cache.index.values()) == ['B', 'C']
+    cache.get_frame('stub', ['B', 'C'], fetch, '2020-01-01', '2020-03-31')
+    assert [tickers for tickers, _, _ in fetch.calls] == [['A'], ['B', 'C']]
+
+
+def test_concurrent_reads_fetch_a_ticker_once(tmp_path):
+    fetch = StubFetch(latency=0.2)
+    cache = PriceCache(str(tmp_path))
+    frames = []
+    threads = [threading.Thread(target=lambda: frames.append(
+        cache.get_frame('stub', ['A', 'B'], fetch, '2020-01-01', '2020-03-31'))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(fetch.calls) == 1
+    for frame in frames[1:]:
+        pd.testing.assert_frame_equal(frame, frames[0])
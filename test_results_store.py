@@ -0,0 +1,62 @@
+import os
+import time
+import pandas as pd
+from results_store import ResultsStore
+from pipeline import prune_results
+from dag import process_context
+
+
+def series(value):
+    return pd.Series([float(value)], index=pd.DatetimeIndex(['2020-01-01']))
+
+
+def test_old_results_are_pruned_per_name(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    for i in range(8):
+        store.get_or_compute('risk', series(i), lambda: i)
+        store.get_or_compute('risk_data', series(i), lambda: -i)
+        time.sleep(0.01)
+    store.prune('risk')
+    store.prune('risk_data')
+    files = sorted(os.listdir(tmp_path))
+    assert len([f for f in files if f.startswith('risk_data_')]) == 5
+    assert len([f for f in files if not f.startswith('risk_data_')]) == 5
+    # the newest results are the ones kept
+    assert ResultsStore(str(tmp_path)).get_or_compute('risk', series(7), lambda: None) == 7
+
+
+def test_pruning_keeps_every_universes_current_result(tmp_path):
+    universes = {'u%d' % i: [] for i in range(8)}
+    store = ResultsStore(str(tmp_path))
+    for refresh in range(3):
+        for i, universe in enumerate(universes):
+            store.get_or_compute(universe + '_risk', series(i), lambda: i)
+        prune_results(store, universes)
+    # a fresh store (as in a worker process) finds every universe's result on disk
+    reader = ResultsStore(str(tmp_path))
+    for i, universe in enumerate(universes):
+        assert reader.get_or_compute(universe + '_risk', series(i), lambda: None) == i
+
+
+def prune_repeatedly(store_dir, name):
+    store = ResultsStore(store_dir)
+    for _ in range(20):
+        store.prune(name, keep=1)
+
+
+def test_concurrent_pruning_and_reads_tolerate_deleted_files(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    keys = ['risk_' + '%040x' % i for i in range(400)]
+    for key in keys:
+        store.put(key, 0)
+    context = process_context()
+    workers = [context.Process(target=prune_repeatedly, args=(str(tmp_path), 'risk')) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    reader = ResultsStore(str(tmp_path))
+    for key in keys:
+        assert reader.get(key) in (0, None)
+    for worker in workers:
+        worker.join(timeout=60)
+    assert [worker.exitcode for worker in workers] == [0, 0]
+    assert len(os.listdir(tmp_path)) == 1
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+from return_panel import ReturnPanel, as_frame
+from pipeline import risk_indicators
+from turbulence import Turbulence
+from test_absorptionratio import one_factor_returns
+
+
+@pytest.fixture
+def prices():
+    return 100. * (1. + one_factor_returns(n_obs=900, n_assets=20)).cumprod()
+
+
+def test_from_prices_is_pct_change(prices):
+    panel = ReturnPanel.from_prices(prices, chunk_size=100)
+    pd.testing.assert_frame_equal(panel.to_frame(), prices.pct_change().dropna(), rtol=1e-12, check_freq=False)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_save_load_round_trip_is_memory_mapped(tmp_path, prices, dtype):
+    panel = ReturnPanel.from_prices(prices, dtype=dtype)
+    panel.save(str(tmp_path / 'sector'))
+    loaded = ReturnPanel.load(str(tmp_path / 'sector'))
+    assert isinstance(loaded.values, np.memmap) and loaded.dtype == dtype
+    np.testing.assert_array_equal(loaded.values, panel.values)
+    assert loaded.index.equals(panel.index)
+    pd.testing.assert_index_equal(loaded.columns, panel.columns)
+    # the frame indicators see is a view on the mapped values, not a copy
+    frame = as_frame(loaded)
+    assert np.shares_memory(frame.values, loaded.values)
+    assert as_frame(frame) is frame
+
+
+@pytest.mark.parametrize('denoise', [False, True])
+def test_float32_indicators_match_float64(prices, denoise):
+    # float32 storage only rounds the returns (about 6e-8 relative); the indicators compute in float64, so
+    # turbulence and the raw absorption ratio agree to 1e-6 relative and the z-scored ratio to 1e-6 absolute
+    exact = risk_indicators(ReturnPanel.from_prices(prices), 252, denoise, 0.9)
+    compact = risk_indicators(ReturnPanel.from_prices(prices, dtype=np.float32), 252, denoise, 0.9)
+    pd.testing.assert_series_equal(compact['absorption_ratio'], exact['absorption_ratio'], rtol=0, atol=1e-6)
+    pd.testing.assert_series_equal(compact['turbulence'], exact['turbulence'], rtol=1e-6)
+    turbulence = Turbulence(ReturnPanel.from_prices(prices, dtype=np.float32), 252).turbulence
+    pd.testing.assert_frame_equal(turbulence, Turbulence(ReturnPanel.from_prices(prices), 252).turbulence,
+                                  rtol=1e-6)
@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import data_fetchers
+import pipeline
+from data_fetchers import get_shiller_data
+from price_cache import PriceCache
+from results_store import ResultsStore
+
+
+def write_shiller_csv(path, prices):
+    # a CSV export of the Data sheet: five title rows, the header (dates column unnamed), two rows of units,
+    # monthly rows dated year.month (October as .1) and a trailing note
+    lines = ['Stock Market Data', '', '', '', '', ',S&P,Dividend', ',Price,', ',,']
+    for i, price in enumerate(prices):
+        year, month = 2000 + i // 12, i % 12 + 1
+        lines.append('%d.%s,%s,1.0' % (year, '1' if month == 10 else '%02d' % month, float(price)))
+    lines.append('note,,')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def expire(cache):
+    # as if the cached columns were fetched long ago, so the next call revalidates them against the file
+    for entry in cache.index.values():
+        entry['fetched_at'] = '2000-01-01T00:00:00+00:00'
+
+
+@pytest.fixture
+def counted(monkeypatch):
+    # counts of workbook reads and parses during ingestion
+    calls = {'read': 0, 'parse': 0}
+    read_source, parse_shiller_data = data_fetchers.read_source, data_fetchers.parse_shiller_data
+
+    def counted_read(url):
+        calls['read'] += 1
+        return read_source(url)
+
+    def counted_parse(*args, **kwargs):
+        calls['parse'] += 1
+        return parse_shiller_data(*args, **kwargs)
+    monkeypatch.setattr(data_fetchers, 'read_source', counted_read)
+    monkeypatch.setattr(data_fetchers, 'parse_shiller_data', counted_parse)
+    return calls
+
+
+def test_workbook_is_parsed_only_when_it_changes(tmp_path, counted):
+    url = str(tmp_path / 'ie_data.csv')
+    write_shiller_csv(url, 100. + np.arange(12.))
+    os.utime(url, (1e9, 1e9))
+    cache = PriceCache(str(tmp_path / 'cache'))
+    first = get_shiller_data(url, None, 5, cache=cache)
+    assert counted == {'read': 1, 'parse': 1}
+    assert first.index[9] == pd.Timestamp('2000-10-01')
+    np.testing.assert_array_equal(first['S&P'].values, 100. + np.arange(12.))
+
+    # unchanged mtime and size: the validators decide without reading the file
+    expire(cache)
+    pd.testing.assert_frame_equal(get_shiller_data(url, None, 5, cache=cache), first)
+    assert counted == {'read': 1, 'parse': 1}
+
+    # touched but identical: read and hashed, not parsed
+    os.utime(url, (2e9, 2e9))
+    expire(cache)
+    pd.testing.assert_frame_equal(get_shiller_data(url, None, 5, cache=cache), first)
+    assert counted == {'read': 2, 'parse': 1}
+    # ...and the new validators are recorded
+    expire(cache)
+    pd.testing.assert_frame_equal(get_shiller_data(url, None, 5, cache=cache), first)
+    assert counted == {'read': 2, 'parse': 1}
+
+    # new content: parsed and replaced
+    write_shiller_csv(url, 100. + np.arange(13.))
+    expire(cache)
+    changed = get_shiller_data(url, None, 5, cache=cache)
+    assert counted == {'read': 3, 'parse': 2}
+    assert changed['S&P'].iloc[-1] == 112.
+
+
+def test_prepared_kkt_data_is_reused_for_unchanged_inputs(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    index = pd.date_range('2000-01-01', periods=60, freq='MS')
+    fred_data = pd.DataFrame({'INDPRO': 100. + rng.normal(size=60).cumsum(),
+                              'PAYEMS': 1000. + rng.normal(size=60).cumsum(),
+                              'T10YFF': rng.normal(1.5, 1., size=60),
+                              'USRECD': (rng.random(60) < .1).astype(float)}, index=index)
+    shiller_data = pd.DataFrame({'S&P': 1000. + rng.normal(size=60).cumsum()}, index=index)
+    prepared = []
+    prepare_kkt_data = pipeline.prepare_kkt_data
+    monkeypatch.setattr(pipeline, 'prepare_kkt_data',
+                        lambda *args: prepared.append(1) or prepare_kkt_data(*args))
+    first = pipeline.cached_kkt_data(fred_data, shiller_data, ResultsStore(str(tmp_path)))
+    again = pipeline.cached_kkt_data(fred_data, shiller_data, ResultsStore(str(tmp_path)))
+    assert len(prepared) == 1
+    pd.testing.assert_frame_equal(again, first)
+    shiller_data.iloc[-1, 0] += 1.
+    pipeline.cached_kkt_data(fred_data, shiller_data, ResultsStore(str(tmp_path)))
+    assert len(prepared) == 2
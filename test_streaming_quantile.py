@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+from streaming_quantile import ExpandingQuantile, P2Quantile
+from turbulence import Turbulence
+from test_absorptionratio import one_factor_returns
+
+
+@pytest.mark.parametrize('quantile', [0., 0.1, 0.5, 0.9, 0.95, 1.])
+def test_expanding_quantile_equals_pandas_with_ties(quantile):
+    # small integers, so most values are tied
+    values = pd.Series(np.random.default_rng(0).integers(0, 5, size=500).astype(float))
+    state = ExpandingQuantile(quantile)
+    streamed = np.array([state.add(value) for value in values])
+    np.testing.assert_array_equal(streamed, values.expanding(min_periods=1).quantile(quantile).values)
+    seeded = ExpandingQuantile(quantile, values[:250])
+    assert seeded.value() == values[:250].quantile(quantile)
+
+
+@pytest.mark.parametrize('min_periods', [1, 10, 30])
+def test_streaming_filter_matches_pandas_at_the_min_periods_boundary(min_periods):
+    returns = one_factor_returns(n_obs=400)
+    exact = Turbulence(returns, window_size=100, quantile=0.9, min_periods=min_periods)
+    streamed = Turbulence(returns, window_size=100, quantile=0.9, min_periods=min_periods, quantile_estimator='exact')
+    pd.testing.assert_frame_equal(streamed.filtered_turbulence, exact.filtered_turbulence, check_freq=False)
+    assert (streamed.filtered_turbulence['Turbulence'].iloc[:min_periods - 1] == 0.).all()
+
+
+def test_p2_stays_within_its_stated_error_bound():
+    # the bound in P2Quantile's comment: 20% from the 100th observation, 7% from the 1,000th, 1.5% from the
+    # 10,000th, relative to the exact expanding quantile of chi-square values
+    for seed in range(10):
+        values = pd.Series(np.random.default_rng(seed).chisquare(10, size=12000))
+        exact = values.expanding(min_periods=1).quantile(0.9).values
+        state = P2Quantile(0.9)
+        error = np.abs(np.array([state.add(value) for value in values]) - exact) / exact
+        assert error[100:].max() <= 0.2
+        assert error[1000:].max() <= 0.07
+        assert error[10000:].max() <= 0.015
@@ -0,0 +1,89 @@
+import asyncio
+import numpy as np
+import pandas as pd
+import pytest
+from absorptionratio import rolling_absorption_ratio
+from turbulence import Turbulence, filter_turbulence
+from streaming_service import StreamingIndicators, StreamingService
+
+
+class ListBarSource:
+    # In-memory bar source: yields every bar of a price frame without pausing, so the producer outpaces the
+    # consumer and the queue fills
+
+    def __init__(self, prices):
+        self.prices = prices
+        self.tickers = list(prices.columns)
+
+    async def __aiter__(self):
+        for timestamp, prices in zip(self.prices.index, self.prices.values):
+            yield timestamp, prices
+
+
+def random_prices(n_bars, n_assets, seed=0):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0., 0.001, size=(n_bars, n_assets)) + rng.normal(0., 0.001, size=(n_bars, 1))
+    return pd.DataFrame(100. * np.cumprod(1. + returns, axis=0),
+                        index=pd.date_range('2020-01-02 09:30', periods=n_bars, freq='min'),
+                        columns=['A%d' % i for i in range(n_assets)])
+
+
+def run_service(prices, **kwargs):
+    service = StreamingService(ListBarSource(prices), **kwargs)
+
+    async def run():
+        subscriber = service.subscribe(maxsize=len(prices) + 1)
+        await service.run()
+        return [subscriber.get_nowait() for _ in range(subscriber.qsize())]
+    return service, asyncio.run(run())
+
+
+def test_conflate_drops_the_oldest_bars():
+    prices = random_prices(200, 4)
+    service, received = run_service(prices, window_size=20, queue_size=50, overflow='conflate')
+    assert service.stats()['received'] == 200
+    assert service.stats()['dropped'] == 150
+    # the last 50 bars were processed: 49 returns, hence 30 full windows
+    assert list(service.recent().index) == list(prices.index[-30:])
+    assert len(received) == 31
+
+
+def test_block_never_drops():
+    prices = random_prices(200, 4)
+    service, received = run_service(prices, window_size=20, queue_size=8, overflow='block')
+    assert service.stats()['dropped'] == 0
+    assert list(service.recent().index) == list(prices.index[20:])
+
+
+def test_subscribers_receive_the_end_sentinel():
+    service, received = run_service(random_prices(60, 4), window_size=20, queue_size=8, overflow='block')
+    assert received[-1] is None
+    assert all(update is not None for update in received[:-1])
+    assert len(received) - 1 == len(service.recent())
+
+
+@pytest.mark.parametrize('method', ['auto', 'truncated', 'dense'])
+def test_streaming_indicators_match_batch(method):
+    prices = random_prices(300, 30)
+    returns = prices.pct_change().dropna()
+    window_size = 60
+    indicators = StreamingIndicators(30, window_size=window_size, quantile=0.9, quantile_estimator='exact',
+                                     method=method)
+    updates = [indicators.update(row) for row in prices.values]
+    updates = pd.DataFrame([update for update in updates if update is not None],
+                           index=returns.index[window_size - 1:])
+    turbulence = Turbulence(returns, window_size, quantile=0.9).turbulence['Turbulence']
+    np.testing.assert_allclose(updates['turbulence'], turbulence, rtol=1e-8)
+    np.testing.assert_allclose(updates['filtered_turbulence'], filter_turbulence(turbulence, 0.9), rtol=1e-8)
+    np.testing.assert_allclose(updates['absorption_ratio'], rolling_absorption_ratio(returns, window_size),
+                               rtol=1e-7)
+
+
+def test_short_windows_use_the_exact_reduced_spectrum():
+    # window_size <= N: turbulence is degenerate but the absorption ratio comes from the window x window problem
+    prices = random_prices(80, 30)
+    returns = prices.pct_change().dropna()
+    indicators = StreamingIndicators(30, window_size=25)
+    updates = [indicators.update(row) for row in prices.values]
+    absorption_ratio = [update['absorption_ratio'] for update in updates if update is not None]
+    np.testing.assert_allclose(absorption_ratio, rolling_absorption_ratio(returns, 25), rtol=1e-8)
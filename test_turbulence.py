@@ -0,0 +1,51 @@
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+from turbulence import Turbulence
+from test_absorptionratio import one_factor_returns
+
+
+def updated_through_state(returns, n_new, step, exact_quantile, **kwargs):
+    # the last n_new rows applied in `step`-row update() calls, each on a state pickled and restored
+    turbulence = Turbulence(returns.iloc[:-n_new], window_size=252, quantile=0.9, **kwargs)
+    new_turbulence, new_filtered = [], []
+    for start in range(len(returns) - n_new, len(returns), step):
+        state = pickle.loads(pickle.dumps(turbulence.get_state(exact_quantile=exact_quantile)))
+        turbulence = Turbulence.from_state(state)
+        turbulence.update(returns.iloc[:start + step])
+        new_turbulence.append(turbulence.turbulence)
+        new_filtered.append(turbulence.filtered_turbulence)
+    return pd.concat(new_turbulence), pd.concat(new_filtered)
+
+
+@pytest.mark.parametrize('method', ['batch', 'streaming'])
+def test_update_from_state_equals_recompute(method):
+    returns = one_factor_returns()
+    full = Turbulence(returns, window_size=252, quantile=0.9, method=method)
+    new_turbulence, new_filtered = updated_through_state(returns, 100, 7, exact_quantile=True, method=method)
+    pd.testing.assert_frame_equal(new_turbulence, full.turbulence.iloc[-100:], rtol=1e-8, check_freq=False)
+    pd.testing.assert_frame_equal(new_filtered, full.filtered_turbulence.iloc[-100:], rtol=1e-8,
+                                  check_freq=False)
+
+
+@pytest.mark.parametrize('method', ['batch', 'streaming'])
+def test_bounded_state_keeps_turbulence_exact(method):
+    # the default state sketches the quantile: turbulence is unchanged and the filter keeps P2's accuracy
+    returns = one_factor_returns()
+    full = Turbulence(returns, window_size=252, quantile=0.9, method=method)
+    new_turbulence, new_filtered = updated_through_state(returns, 100, 7, exact_quantile=False, method=method)
+    pd.testing.assert_frame_equal(new_turbulence, full.turbulence.iloc[-100:], rtol=1e-8, check_freq=False)
+    exact = full.filtered_turbulence['Turbulence'].iloc[-100:]
+    mismatched = (new_filtered['Turbulence'].values != exact.values).mean()
+    assert mismatched <= 0.05
+
+
+def test_bounded_state_does_not_grow_with_history():
+    returns = one_factor_returns(n_obs=2000)
+    sizes = [len(pickle.dumps(Turbulence(returns.iloc[:n_obs], window_size=252).get_state()))
+             for n_obs in (600, 2000)]
+    assert sizes[0] == sizes[1]
+    exact_sizes = [len(pickle.dumps(Turbulence(returns.iloc[:n_obs], window_size=252).get_state(exact_quantile=True)))
+                   for n_obs in (600, 2000)]
+    assert exact_sizes[1] > exact_sizes[0]
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+from constants import PLOT_MAX_POINTS
+from visuals import decimate
+from results_store import ResultsStore
+
+
+def spiky_series(n_obs=6000, seed=0):
+    # sparse chi-square spikes on zero, as filtered turbulence
+    rng = np.random.default_rng(seed)
+    values = np.where(rng.random(n_obs) < .05, rng.chisquare(10, n_obs), 0.)
+    return pd.Series(values, index=pd.bdate_range('2000-01-03', periods=n_obs))
+
+
+def walk_series(n_obs=6000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.Series(np.cumsum(rng.normal(size=n_obs)), index=pd.bdate_range('2000-01-03', periods=n_obs))
+
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+@pytest.mark.parametrize('max_points', [1, 2, 3, 4, 5, 99, 100, 2000])
+def test_decimation_keeps_the_budget_and_the_endpoints(method, max_points):
+    series = spiky_series() if method == 'minmax' else walk_series()
+    decimated = decimate(series, max_points, method)
+    assert len(decimated) <= max_points
+    assert decimated.index.is_monotonic_increasing and decimated.index.is_unique
+    if max_points >= 2:
+        assert decimated.index[0] == series.index[0] and decimated.index[-1] == series.index[-1]
+
+
+def test_minmax_keeps_every_buckets_extrema():
+    series = spiky_series()
+    decimated = decimate(series, 200, 'minmax')
+    assert series.idxmax() in decimated.index and series.idxmin() in decimated.index
+    # each of the 99 buckets contributes its maximum
+    edges = np.linspace(0, len(series), 99 + 1).astype(int)
+    for start, end in zip(edges[:-1], edges[1:]):
+        assert series.iloc[start:end].max() == decimated.loc[series.index[start]:series.index[end - 1]].max()
+
+
+def test_short_series_are_not_decimated():
+    series = walk_series(n_obs=50)
+    pd.testing.assert_series_equal(decimate(series, 100), series)
+
+
+def test_x_range_is_sliced_before_decimating():
+    series = walk_series()
+    x_range = ['2005-01-01', '2005-06-30']
+    visible = series.loc['2005-01-01':'2005-06-30']
+    pd.testing.assert_series_equal(decimate(series, PLOT_MAX_POINTS, 'lttb', x_range), visible)
+    zoomed = decimate(series, 50, 'lttb', x_range)
+    assert len(zoomed) == 50
+    assert zoomed.index[0] == visible.index[0] and zoomed.index[-1] == visible.index[-1]
+
+
+@pytest.fixture
+def published(tmp_path, monkeypatch):
+    import main
+    store = ResultsStore(str(tmp_path))
+    store.publish({'sector_turbulence': spiky_series(n_obs=10000)})
+    monkeypatch.setattr(main, 'results_store', store)
+    return main
+
+
+def patched(patch):
+    return {tuple(operation['location']): operation['params']['value']
+            for operation in patch.to_plotly_json()['operations']}
+
+
+def test_zoom_patches_the_visible_range_at_full_resolution(published):
+    x_range = ['2010-01-01', '2011-12-31']
+    patch = patched(published.zoom_figure({'xaxis.range[0]': x_range[0], 'xaxis.range[1]': x_range[1]},
+                                          'sector_turbulence', 'minmax'))
+    visible = spiky_series(n_obs=10000).loc[x_range[0]:x_range[1]]
+    assert list(patch[('data', 0, 'x')]) == list(visible.index)
+    np.testing.assert_array_equal(patch[('data', 0, 'y')], visible.values)
+    assert patch[('layout', 'xaxis', 'range')] == x_range
+
+
+def test_zoom_reset_redraws_the_decimated_full_series(published):
+    patch = patched(published.zoom_figure({'xaxis.autorange': True}, 'sector_turbulence', 'minmax'))
+    assert len(patch[('data', 0, 'x')]) <= PLOT_MAX_POINTS
+    assert patch[('layout', 'xaxis', 'autorange')] is True
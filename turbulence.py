@@ -1,37 +1,258 @@
+import copy
 import numpy as np
 import pandas as pd
+from streaming_quantile import ExpandingQuantile, P2Quantile, QUANTILE_ESTIMATORS
+from covariance_estimators import rolling_frame, detach
+from return_panel import as_frame
+
+
+def turbulence_from_covariances(values, end, means, covs):
+    # Mahalanobis distance of rows end, end + 1, ... of `values` from their windows' means and covariances
+    delta = values[end:end + len(covs)] - means
+    return np.einsum('ti,ti->t', delta, np.linalg.solve(covs, delta[..., None])[..., 0])
+
+
+def filter_turbulence(turbulence, quantile, min_periods=10):
+    # turbulence above its expanding quantile, zero elsewhere
+    threshold = turbulence.expanding(min_periods=min_periods).quantile(quantile)
+    return turbulence.where(turbulence > threshold, 0.)
+
+
+class RollingInverseCovariance:
+    # Window mean and inverse sample covariance kept current with Sherman-Morrison rank-1 updates.
+    # The window rows live in a ring buffer so the inverse can be refactored from scratch every
+    # `refactor_every` steps (numerical drift) or whenever an update would be near-singular.
+    # With track_scatter the scatter matrix itself is kept current by the same rank-1 updates (for consumers
+    # of the covariance, such as the streaming absorption ratio).
+
+    def __init__(self, window, refactor_every=None, rcond=1e-10, track_scatter=False):
+        self.buffer = np.array(window, dtype=np.float64)
+        self.window_size, self.n_assets = self.buffer.shape
+        self.refactor_every = refactor_every or self.window_size
+        self.rcond = rcond
+        self.track_scatter = track_scatter
+        self.scatter = None
+        self.position = 0
+        self.refactor()
+
+    def refactor(self):
+        self.mean = self.buffer.mean(axis=0)
+        centered = self.buffer - self.mean
+        scatter = centered.T.dot(centered)
+        if self.track_scatter:
+            self.scatter = scatter.copy()
+        eig_vals = np.linalg.eigvalsh(scatter)
+        self.singular = eig_vals[0] <= self.rcond * eig_vals[-1]
+        if self.singular:
+            self.inv_scatter = np.linalg.pinv(scatter, hermitian=True)
+        else:
+            self.inv_scatter = np.linalg.inv(scatter)
+        self.steps = 0
+
+    def _rank_one_update(self, u, c):
+        # (S + c.u.u')^-1 from S^-1; False if the update would leave S near-singular
+        pu = self.inv_scatter.dot(u)
+        denominator = 1. + c * u.dot(pu)
+        if denominator <= self.rcond:
+            return False
+        self.inv_scatter -= (c / denominator) * np.outer(pu, pu)
+        if self.track_scatter:
+            self.scatter += c * np.outer(u, u)
+        return True
+
+    def roll(self, row):
+        row = np.asarray(row, dtype=np.float64)
+        leaving = self.buffer[self.position].copy()
+        self.buffer[self.position] = row
+        self.position = (self.position + 1) % self.window_size
+        self.steps += 1
+        if self.singular or self.steps >= self.refactor_every:
+            self.refactor()
+            return
+        n = self.window_size
+        # add the new row (n -> n + 1 points), then drop the oldest (n + 1 -> n points)
+        u = row - self.mean
+        updated = self._rank_one_update(u, n / (n + 1.))
+        self.mean += u / (n + 1.)
+        u = leaving - self.mean
+        updated = updated and self._rank_one_update(u, -(n + 1.) / n)
+        self.mean -= u / n
+        if not updated:
+            self.refactor()
+
+    def get_state(self):
+        return {'buffer': self.buffer.copy(), 'position': self.position, 'mean': self.mean.copy(),
+                'inv_scatter': self.inv_scatter.copy(), 'singular': self.singular, 'steps': self.steps,
+                'refactor_every': self.refactor_every, 'rcond': self.rcond, 'track_scatter': self.track_scatter,
+                'scatter': None if self.scatter is None else self.scatter.copy()}
+
+    @classmethod
+    def from_state(cls, state):
+        rolling = cls.__new__(cls)
+        rolling.__dict__.update({key: value.copy() if isinstance(value, np.ndarray) else value
+                                 for key, value in state.items()})
+        rolling.window_size, rolling.n_assets = rolling.buffer.shape
+        return rolling
+
+    def inverse_covariance(self):
+        return (self.window_size - 1) * self.inv_scatter
+
+    def covariance(self):
+        return self.scatter / (self.window_size - 1)
+
+    def mahalanobis(self, row):
+        delta = np.asarray(row, dtype=np.float64) - self.mean
+        return (self.window_size - 1) * delta.dot(self.inv_scatter).dot(delta)
+
 
 class Turbulence:
 
-    def __init__(self, returns, window_size, quantile=0.95):
-        self.returns = returns
+    def __init__(self, returns, window_size, quantile=0.95, method='batch', refactor_every=None, min_periods=10,
+                 quantile_estimator=None, estimator=None):
+        # a DataFrame or a ReturnPanel (viewed as a frame without copying)
+        self.returns = as_frame(returns)
         self.window_size = window_size
         self.quantile = quantile
+        self.method = method
+        self.refactor_every = refactor_every
+        self.min_periods = min_periods
+        # None: pandas expanding quantile; 'exact': two-heap streaming; 'p2': bounded-memory approximation
+        # (up to 7% relative error in the threshold after 1,000 values and 20% before, see P2Quantile)
+        self.quantile_estimator = quantile_estimator
+        self.inverse_covariance_state = None
+        # a covariance_estimators estimator (or PrefixCovariances shared with AbsorptionRatio) replaces the
+        # batch/streaming sample covariances
+        self.estimator = estimator
         self.turbulence = self.calculate_turbulence()
+        if self.estimator is not None:
+            self.estimator = detach(self.estimator)
         self.filtered_turbulence = self.filter_turbulence()
 
     def calculate_turbulence(self):
-        turbulence = pd.DataFrame(index=self.returns.index[(self.window_size - 1):], columns=['Turbulence'])
+        if self.estimator is not None:
+            return self.calculate_turbulence_estimator(self.returns)
+        if self.method == 'streaming':
+            return self.calculate_turbulence_streaming(self.returns)
+        if self.method != 'batch':
+            raise ValueError("method must be 'batch' or 'streaming', got %r" % self.method)
+        return self.calculate_turbulence_batch(self.returns)
+
+    def calculate_turbulence_batch(self, returns):
+        turbulence = np.empty(max(len(returns) - self.window_size + 1, 0))
         start = 0
         for end in range(len(turbulence)):
-            sample_returns = self.returns.iloc[start:self.window_size + end, :]
+            sample_returns = returns.iloc[start:self.window_size + end, :]
             sample_means = sample_returns.mean()
             inv_cov = np.linalg.inv(np.cov(sample_returns, rowvar=False))
             current_returns = sample_returns.iloc[-1, :]
             delta = np.array((current_returns - sample_means)).reshape(1, -1)
-            turbulence.iloc[end, 0] = delta.dot(inv_cov).dot(delta.transpose())[0][0]
+            turbulence[end] = delta.dot(inv_cov).dot(delta.transpose())[0][0]
             start += 1
-        return turbulence
+        return pd.DataFrame(turbulence, index=returns.index[(self.window_size - 1):], columns=['Turbulence'])
+
+    def calculate_turbulence_streaming(self, returns):
+        # O(N^2) per day: the window inverse covariance is updated as rows enter and leave.
+        # Without a saved state the first window of `returns` seeds one and yields the first value.
+        values = np.asarray(returns)
+        turbulence = []
+        if self.inverse_covariance_state is None:
+            self.inverse_covariance_state = RollingInverseCovariance(values[:self.window_size],
+                                                                     refactor_every=self.refactor_every)
+            turbulence.append(self.inverse_covariance_state.mahalanobis(values[self.window_size - 1]))
+            values = values[self.window_size:]
+        for row in values:
+            self.inverse_covariance_state.roll(row)
+            turbulence.append(self.inverse_covariance_state.mahalanobis(row))
+        return pd.DataFrame(turbulence, index=returns.index[len(returns) - len(turbulence):], columns=['Turbulence'],
+                            dtype=np.float64)
+
+    def calculate_turbulence_estimator(self, returns, resume=False):
+        # Mahalanobis distance of each window's last row from the estimator's window mean and covariance,
+        # one stacked solve per block of windows
+        values = np.asarray(returns)
+        blocks = [(end, turbulence_from_covariances(values, end, means, covs))
+                  for end, means, covs in self.estimator.rolling(returns, self.window_size, resume=resume)]
+        return rolling_frame(blocks, returns, 'Turbulence').to_frame()
 
     def filter_turbulence(self):
-        filter = self.turbulence.expanding(min_periods=10).quantile(self.quantile)
-        filtered_turbulence = self.turbulence[self.turbulence > filter].fillna(0.)
+        if self.quantile_estimator is not None:
+            self.quantile_state = QUANTILE_ESTIMATORS[self.quantile_estimator](self.quantile)
+            return self.filter_new_turbulence(self.turbulence)
+        filtered_turbulence = filter_turbulence(self.turbulence, self.quantile, self.min_periods)
+        # later update() calls continue the same exact quantile with the streaming estimator
+        self.quantile_state = ExpandingQuantile(self.quantile, self.turbulence['Turbulence'])
         return filtered_turbulence
 
+    def filter_new_turbulence(self, new_turbulence):
+        # expanding-quantile filter for appended values, continuing from the history in quantile_state
+        filtered = []
+        for value in new_turbulence['Turbulence']:
+            threshold = self.quantile_state.add(value)
+            passes = len(self.quantile_state) >= self.min_periods and value > threshold
+            filtered.append(value if passes else 0.)
+        return pd.DataFrame(filtered, index=new_turbulence.index, columns=['Turbulence'], dtype=np.float64)
+
+    def update(self, new_returns):
+        # Append turbulence for the rows of new_returns after the last date seen and return them.
+        # The windows only reach back window_size - 1 rows, so the indicator work does not grow with history.
+        new_returns = as_frame(new_returns)
+        new_returns = new_returns.loc[new_returns.index > self.returns.index[-1]]
+        if self.estimator is not None and self.estimator.recursive:
+            new_turbulence = self.calculate_turbulence_estimator(new_returns, resume=True)
+        elif self.estimator is not None:
+            tail = pd.concat([self.returns.iloc[-(self.window_size - 1):], new_returns])
+            new_turbulence = self.calculate_turbulence_estimator(tail)
+        elif self.method == 'streaming':
+            new_turbulence = self.calculate_turbulence_streaming(new_returns)
+        else:
+            tail = pd.concat([self.returns.iloc[-(self.window_size - 1):], new_returns])
+            new_turbulence = self.calculate_turbulence_batch(tail)
+        self.returns = pd.concat([self.returns, new_returns])
+        self.turbulence = pd.concat([self.turbulence, new_turbulence])
+        self.filtered_turbulence = pd.concat([self.filtered_turbulence, self.filter_new_turbulence(new_turbulence)])
+        return new_turbulence
+
+    def get_state(self, exact_quantile=False):
+        # Everything update() needs, as plain picklable objects. The exact quantile state holds the whole
+        # turbulence history, so by default it is stored as a P2Quantile sketch with its markers at the exact
+        # quantiles: the state then has the same size however long the history, and later thresholds carry P2's
+        # error (within 7% after 1,000 values). exact_quantile=True keeps the exact state, which grows with the
+        # history.
+        quantile_state = self.quantile_state
+        if isinstance(quantile_state, ExpandingQuantile) and not exact_quantile:
+            quantile_state = P2Quantile.from_values(self.quantile, quantile_state.values())
+        return {'window_size': self.window_size,
+                'quantile': self.quantile,
+                'method': self.method,
+                'refactor_every': self.refactor_every,
+                'min_periods': self.min_periods,
+                'quantile_estimator': self.quantile_estimator,
+                'estimator': detach(self.estimator),
+                'returns': self.returns.iloc[-(self.window_size - 1):],
+                'quantile_state': copy.deepcopy(quantile_state),
+                'inverse_covariance': None if self.inverse_covariance_state is None
+                else self.inverse_covariance_state.get_state()}
+
+    @classmethod
+    def from_state(cls, state):
+        # Restore from get_state(); turbulence and filtered_turbulence then only hold values added by update()
+        turbulence = cls.__new__(cls)
+        for name in ['window_size', 'quantile', 'method', 'refactor_every', 'min_periods', 'quantile_estimator',
+                     'returns']:
+            setattr(turbulence, name, state[name])
+        turbulence.quantile_state = copy.deepcopy(state['quantile_state'])
+        turbulence.estimator = detach(state['estimator'])
+        turbulence.inverse_covariance_state = None if state['inverse_covariance'] is None \
+            else RollingInverseCovariance.from_state(state['inverse_covariance'])
+        turbulence.turbulence = pd.DataFrame(columns=['Turbulence'], index=state['returns'].index[:0],
+                                             dtype=np.float64)
+        turbulence.filtered_turbulence = turbulence.turbulence.copy()
+        return turbulence
+
 if __name__ == '__main__':
     from data_fetchers import get_yahoo_data
     from constants import *
     returns = get_yahoo_data(['SPY', 'TLT', 'LQD', 'HYG', 'GLD', 'VNQ'], start_date=START_DATE,
                              end_date=END_DATE).pct_change()
     returns.dropna(inplace=True)
-    turbulence = Turbulence(returns=returns, window_size=WINDOW_SIZE)
\ No newline at end of file
+    turbulence = Turbulence(returns=returns, window_size=WINDOW_SIZE)
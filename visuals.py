@@ -1,9 +1,73 @@
 
+import numpy as np
+import pandas as pd
 import plotly.graph_objs as go
 
+
+def evenly_spaced(n, n_out):
+    # n_out (< n) indices spread from the first to the last point, for budgets too small to decimate by shape
+    return np.linspace(0, n - 1, n_out).astype(np.int64)
+
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: keep the first and last points and, from each of n_out - 2 buckets, the point
+    # forming the largest triangle with the previously kept point and the average of the next bucket
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return evenly_spaced(n, n_out)
+    every = (n - 2) / (n_out - 2)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    kept = 0
+    for i in range(n_out - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        if end >= next_end:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        else:
+            avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[kept] - avg_x) * (y[start:end] - y[kept]) - (x[kept] - x[start:end]) * (avg_y - y[kept]))
+        kept = start + int(np.argmax(area))
+        indices[i + 1] = kept
+    return indices
+
+
+def min_max(x, y, n_out):
+    # the first and last points plus the minimum and maximum of each of (n_out - 2) / 2 equal buckets, so no
+    # spike is dropped and at most n_out points are kept
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 4:
+        return evenly_spaced(n, n_out)
+    edges = np.linspace(0, n, (n_out - 2) // 2 + 1).astype(np.int64)
+    indices = [0, n - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            indices += [start + int(np.argmin(y[start:end])), start + int(np.argmax(y[start:end]))]
+    return np.unique(indices)
+
+
+DECIMATORS = {'lttb': lttb, 'minmax': min_max}
+
+
+def decimate(series, max_points=None, method='lttb', x_range=None):
+    # The points of `series` (optionally only those within x_range) to draw at most max_points
+    series = series.dropna()
+    if x_range is not None:
+        series = series.loc[pd.Timestamp(x_range[0]):pd.Timestamp(x_range[1])]
+    if max_points is None or len(series) <= max_points:
+        return series
+    x = series.index.values.astype('datetime64[ns]').view(np.int64).astype(np.float64)
+    return series.iloc[DECIMATORS[method](x, series.values.astype(np.float64), max_points)]
+
+
 class PlotMaker:
 
-    def __init__(self, series,go_trace, title, xaxis_title, yaxis_title, color=None, mode=None):
+    def __init__(self, series,go_trace, title, xaxis_title, yaxis_title, color=None, mode=None, max_points=None,
+                 decimation='lttb'):
         self.series = series
         self.go_trace = go_trace
         self.title = title
@@ -11,13 +75,19 @@ class PlotMaker:
         self.yaxis_title = yaxis_title
         self.color = color
         self.mode = mode
+        # go.Scattergl renders on WebGL; max_points decimates server side ('lttb' for shape, 'minmax' for spikes)
+        self.max_points = max_points
+        self.decimation = decimation
         self.plot = self.create_plot()
 
     def create_plot(self):
+        # uirevision keeps the user's zoom when the figure is rebuilt on a refresh
         plot = go.Figure(layout=go.Layout(
             title=self.title,
             xaxis=dict(title=self.xaxis_title),
-            yaxis=dict(title=self.yaxis_title), ), )
+            yaxis=dict(title=self.yaxis_title),
+            uirevision=self.title, ), )
 
-        plot.add_trace(self.go_trace(y=self.series, x=self.series.index, marker=dict(color=self.color)))
+        series = decimate(self.series, self.max_points, self.decimation)
+        plot.add_trace(self.go_trace(y=series, x=series.index, marker=dict(color=self.color)))
         return plot